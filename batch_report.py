@@ -0,0 +1,238 @@
+import argparse
+import logging
+import os
+import time
+
+import pandas as pd
+
+from charts import render_many
+from data_loader import CASH_FLOW_FILE_KINDS, DATASET_CACHE, scan_data_dir
+from data_views import daily_flow_table
+from forecast import METHOD_MODEL, METHOD_SAME_CLASS, forecast_table
+from page_data import (DENOMINATION_LABELS, MONEY_TYPES, atm_months, balances_chart, branch_entry, column_denomination,
+                       comparison_table, daily_balance, daily_balance_chart, daily_denomination_means,
+                       denomination_flow_frame, denomination_trend_chart, flow_comparison, flow_months, flows_chart,
+                       forecast_chart, hourly_deposits, hourly_deposits_chart, hourly_heatmap, hourly_heatmap_chart,
+                       money_type_columns, month_cash_flows, overview_summary, transactions_chart)
+from tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# 出力する予測方法
+FORECAST_METHODS = [METHOD_SAME_CLASS, METHOD_MODEL]
+
+# CSVはExcelでそのまま開けるようにBOM付きUTF-8で保存
+CSV_ENCODING = 'utf-8-sig'
+
+
+class ReportItem:
+    """出力する1件分の集計表とグラフ（グラフがない場合はspecがNone）"""
+
+    def __init__(self, path, table, spec=None):
+        self.path = path
+        self.table = table
+        self.spec = spec
+
+
+def load_branches(base_dir, codes=None):
+    """データディレクトリから支店ごとのATM精算データと現金フローデータを読み込む"""
+    catalog = scan_data_dir(base_dir)
+    codes = codes or catalog.branch_codes
+
+    tasks = {code: (catalog.settlement_path(code), 'atm') for code in codes if catalog.settlement_path(code)}
+    flow_tasks = [
+        (catalog.path(code, data_type), key)
+        for code in codes for key, data_type in CASH_FLOW_FILE_KINDS.items()
+        if catalog.path(code, data_type)
+    ]
+    results = DATASET_CACHE.load_many(list(tasks.values()) + flow_tasks)
+
+    branch_data = {}
+    for code, task in tasks.items():
+        atm_df = results[task]
+        if isinstance(atm_df, Exception):
+            logger.warning("支店%sのデータ読み込みでエラー: %s", code, atm_df)
+            continue
+        branch_data[code] = branch_entry(atm_df)
+
+    cash_flow_data = {}
+    for code in codes:
+        frames = {}
+        for key, data_type in CASH_FLOW_FILE_KINDS.items():
+            task = (catalog.path(code, data_type), key)
+            if task not in results:
+                continue
+            if isinstance(results[task], Exception):
+                logger.warning("ファイル %s_%s.csv の読み込みエラー: %s", code, data_type, results[task])
+                continue
+            frames[key] = results[task]
+        if frames:
+            cash_flow_data[code] = frames
+
+    return branch_data, cash_flow_data
+
+
+def overview_items(code, data, month):
+    """概要：時間帯別の入金取引数・日別の在高金額・月の要約"""
+    cube = data['cube']
+    hourly = hourly_deposits(cube, month)
+    balance = daily_balance(cube, month)
+    summary = pd.DataFrame([{'支店': code, '月': str(month), **overview_summary(cube, month)}]).set_index('支店')
+    return [
+        ReportItem('overview_summary', summary),
+        ReportItem('overview_hourly', hourly.rename('ATM現金入金取引数').rename_axis('時間帯').to_frame(),
+                   hourly_deposits_chart(hourly, f'{code} 時間帯別ATM現金入金取引数')),
+        ReportItem('overview_daily_balance', balance.rename('在高金額（百万円）').rename_axis('日付').to_frame(),
+                   daily_balance_chart(balance, f'{code} 日別在高金額推移'))
+    ]
+
+
+def denomination_items(code, data, month):
+    """金種別分析：紙幣・硬貨の日別推移と金種ごとの時間帯×日付のヒートマップ"""
+    cube = data['cube']
+    items = []
+    for money_type, name in zip(MONEY_TYPES, ['bills', 'coins']):
+        cols, labels = money_type_columns(data, money_type)
+        if not cols:
+            continue
+        daily_values = daily_denomination_means(cube, month, cols, labels)
+        items.append(ReportItem(
+            f'denomination_{name}_trend', daily_values.rename_axis('日付'),
+            denomination_trend_chart(daily_values, f'{code} {money_type}種別の推移')
+        ))
+        for col in cols:
+            pivot_data = hourly_heatmap(cube, month, col)
+            items.append(ReportItem(
+                f'denomination_heatmap_{column_denomination(col)}', pivot_data.rename_axis('時間帯'),
+                hourly_heatmap_chart(pivot_data, labels[col])
+            ))
+    return items
+
+
+def comparison_items(branch_data, flows, month):
+    """支店間比較：月の取引件数と平均在高金額、現金フロー（⑤合計）の月合計"""
+    items = []
+    table = comparison_table(branch_data, month)
+    if not table.empty:
+        items.extend([
+            ReportItem('comparison', table),
+            ReportItem('comparison_transactions', None,
+                       transactions_chart(table['取引件数'], f'{month} 支店別取引件数')),
+            ReportItem('comparison_balances', None,
+                       balances_chart(table['平均在高金額（百万円）'], f'{month} 支店別平均在高金額'))
+        ])
+    flow_totals = flow_comparison(flows, month)
+    if not flow_totals.empty:
+        items.append(ReportItem('comparison_cash_flow', flow_totals))
+    return items
+
+
+def cash_flow_items(code, flows, forecasts, month):
+    """現金フロー分析：金種ごとの日次フローと2種類の予測値"""
+    month_flows, month_forecasts = month_cash_flows(flows, forecasts, code, month, FORECAST_METHODS)
+    items = []
+    for value, label in DENOMINATION_LABELS.items():
+        flow_df = denomination_flow_frame(month_flows, month_forecasts, value, month)
+        items.extend([
+            ReportItem(f'cash_flow_{value}', flow_df.round(1), flows_chart(flow_df, f'{code} {label}の現金フロー')),
+            ReportItem(f'cash_flow_{value}_forecast', None,
+                       forecast_chart(flow_df, FORECAST_METHODS, f'{code} {label}の釣銭予測'))
+        ])
+    return items
+
+
+def write_bundle(out_dir, items, charts=True, executor=None):
+    """集計表をCSVに、グラフをPNGに保存し、保存したファイルの一覧を返す
+
+    グラフはrender_manyでまとめてプロセスプールに送って描画する。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for item in items:
+        if item.table is not None:
+            path = os.path.join(out_dir, f'{item.path}.csv')
+            item.table.to_csv(path, encoding=CSV_ENCODING)
+            written.append(path)
+
+    if charts:
+        with_charts = [item for item in items if item.spec is not None]
+        for item, image in zip(with_charts, render_many([item.spec for item in with_charts], executor)):
+            path = os.path.join(out_dir, f'{item.path}.png')
+            with open(path, 'wb') as f:
+                f.write(image)
+            written.append(path)
+    return written
+
+
+def generate_reports(base_dir, out_dir, codes=None, months=None, charts=True, executor=None):
+    """全支店・全月の概要・金種別・支店間比較・現金フローの結果を出力
+
+    出力先は{out_dir}/{支店コード}/{年-月}/と{out_dir}/comparison/{年-月}/。
+    出力したファイルの一覧をindex.csvに保存し、そのデータフレームを返す。
+    """
+    started = time.perf_counter()
+    branch_data, cash_flow_data = load_branches(base_dir, codes)
+    flows = daily_flow_table(cash_flow_data)
+    forecasts = forecast_table(flows)
+    months = {pd.Period(m, freq='M') for m in months} if months else None
+
+    def selected(available):
+        return sorted(m for m in available if months is None or m in months)
+
+    index = []
+
+    def record(code, month, analysis, paths):
+        index.extend({'支店': code, '月': str(month), '分析': analysis, 'ファイル': path} for path in paths)
+
+    for code in sorted(set(branch_data) | set(cash_flow_data)):
+        branch_months = selected(atm_months(branch_data[code])) if code in branch_data else []
+
+        # 支店ごとに全月分のグラフをまとめて描画する
+        items = {}
+        for month in branch_months:
+            if branch_data[code]['cube'].row_count(month) == 0:
+                continue
+            items[(month, '概要')] = overview_items(code, branch_data[code], month)
+            items[(month, '金種別分析')] = denomination_items(code, branch_data[code], month)
+        for month in selected(flow_months(flows, code)):
+            items[(month, '現金フロー分析')] = cash_flow_items(code, flows, forecasts, month)
+
+        for (month, analysis), month_items in sorted(items.items()):
+            paths = write_bundle(os.path.join(out_dir, code, str(month)), month_items, charts, executor)
+            record(code, month, analysis, paths)
+        print(f"支店{code}のレポートを出力しました（{len(items)}件）")
+
+    all_months = selected(
+        {m for data in branch_data.values() for m in atm_months(data)}
+        | {m for code in cash_flow_data for m in flow_months(flows, code)}
+    )
+    for month in all_months:
+        paths = write_bundle(os.path.join(out_dir, 'comparison', str(month)),
+                             comparison_items(branch_data, flows, month), charts, executor)
+        record(None, month, '支店間比較', paths)
+
+    index = pd.DataFrame(index, columns=['支店', '月', '分析', 'ファイル'])
+    index.to_csv(os.path.join(out_dir, 'index.csv'), index=False, encoding=CSV_ENCODING)
+    print(f"レポートの出力が完了しました（{len(index)}ファイル, {time.perf_counter() - started:.1f}秒）")
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='全支店・全月の分析結果をCSVとPNGに出力します（Streamlitは不要）'
+    )
+    parser.add_argument('data_dir', nargs='?', default='.', help='CSVファイルのあるディレクトリ（既定: カレント）')
+    parser.add_argument('--out', default='reports', help='出力先ディレクトリ（既定: reports）')
+    parser.add_argument('--branch', action='append', help='対象の支店コード（複数指定可、既定: すべて）')
+    parser.add_argument('--month', action='append', help='対象の月 YYYY-MM（複数指定可、既定: すべて）')
+    parser.add_argument('--no-charts', action='store_true', help='グラフを出力せずCSVだけを出力')
+    parser.add_argument('--executor', choices=['process', 'serial'],
+                        help='グラフの描画方法（既定: 環境変数ATM_RENDER_EXECUTOR）')
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    generate_reports(args.data_dir, args.out, args.branch, args.month, not args.no_charts, args.executor)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from charts import FIGURE_CACHE, ChartSpec, render_png
+from data_loader import DATASET_CACHE, SIDECAR_DIR
+from data_views import AggregateCube, DailyFlowView
+from forecast import BACKTEST_HORIZONS, BACKTEST_MIN_HISTORY, BACKTEST_STEP, _build_backtest, _build_forecast_table
+from synthetic_data import write_dataset
+from tracing import configure_logging
+
+# データ規模（支店数・日数・1支店1日あたりの平均取引件数）
+SCALES = {
+    'small': {'branches': 3, 'days': 92, 'transactions_per_day': 200},
+    'medium': {'branches': 5, 'days': 184, 'transactions_per_day': 1000},
+    'large': {'branches': 10, 'days': 365, 'transactions_per_day': 3000}
+}
+
+PAGES = ['概要', '金種別分析', '支店間比較', '現金フロー分析']
+
+DASHBOARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py')
+
+
+def measure(stage, func, **info):
+    """関数の処理時間とPythonのメモリ割り当てのピークを計測
+
+    ピークはtracemallocで追跡できる割り当て（Pythonオブジェクトとnumpy配列）で、
+    pyarrowのメモリプールは含まない。戻り値は(関数の戻り値, 計測結果)。
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    record = {'stage': stage, 'seconds': round(seconds, 4), 'peak_mb': round((peak - base) / 1024 ** 2, 2), **info}
+    print(f"  {stage}: {seconds:.2f}秒, ピーク {record['peak_mb']:.1f}MB")
+    return result, record
+
+
+def _clear_caches(data_dir):
+    # 読み込み済みのデータとサイドカーを破棄して、CSVの解析から計測する
+    DATASET_CACHE.clear()
+    shutil.rmtree(os.path.join(data_dir, SIDECAR_DIR), ignore_errors=True)
+
+
+def _run_page(page):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(DASHBOARD_PATH, default_timeout=600)
+    at.session_state['page_selector'] = page
+    at.run()
+    errors = [e.value for e in at.error] + [str(e.value) for e in at.exception]
+    if errors:
+        raise RuntimeError(f'{page}: {errors}')
+
+
+def run_scale(name, data_dir, pages=True, backtest=False):
+    """1つのデータ規模について、生成・読み込み・集計・予測・描画・各ページを計測"""
+    import dashboard
+
+    params = SCALES[name]
+    records = []
+
+    def add(stage, func, **info):
+        result, record = measure(stage, func, scale=name, **params, **info)
+        records.append(record)
+        return result
+
+    rows = add('generate', lambda: write_dataset(data_dir, params['branches'], days=params['days'],
+                                                 transactions_per_day=params['transactions_per_day']))
+    records[-1]['rows'] = rows
+
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        # Streamlitのセッション外で作るため、画面への出力は行われない
+        _clear_caches(data_dir)
+        board = add('startup', dashboard.ATMDashboard)
+
+        _clear_caches(data_dir)
+        board.branch_data, board.cash_flow_data = {}, {}
+        add('load_data', board.load_data, cache='cold')
+        add('load_cash_flow_data', board.load_cash_flow_data, cache='cold')
+
+        DATASET_CACHE.clear()
+        board.branch_data, board.cash_flow_data = {}, {}
+        add('load_data', board.load_data, cache='sidecar')
+        add('load_cash_flow_data', board.load_cash_flow_data, cache='sidecar')
+
+        data = next(iter(board.branch_data.values()))
+        value_cols = data['bill_cols'] + data['coin_cols']
+        cube = add('aggregate_cube', lambda: [AggregateCube(d['atm_df'], d['bill_cols'] + d['coin_cols'])
+                                              for d in board.branch_data.values()])[0]
+        flows = add('daily_flow_table', lambda: DailyFlowView().update(board.cash_flow_data))
+        add('forecast_table', lambda: _build_forecast_table(flows))
+        if backtest:
+            add('backtest', lambda: _build_backtest(flows, BACKTEST_HORIZONS, BACKTEST_STEP, BACKTEST_MIN_HISTORY,
+                                                    'serial', None))
+
+        month = cube.rows.index.get_level_values('日付').min().to_period('M')
+        pivot = cube.hour_date_mean(month, value_cols[0]).round(1)
+        add('render_heatmap', lambda: render_png(ChartSpec('heatmap', pivot, size=(15, 8))))
+
+        if pages:
+            for page in PAGES:
+                FIGURE_CACHE.clear()
+                add(f'page:{page}', lambda page=page: _run_page(page))
+    finally:
+        os.chdir(cwd)
+    return records
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(DASHBOARD_PATH), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales, out_path, work_dir=None, pages=True, backtest=False):
+    """指定した規模ごとに計測し、結果をJSONファイルに保存して返す"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='atm_benchmark_')
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'results': []
+    }
+
+    tracemalloc.start()
+    try:
+        for name in scales:
+            print(f"規模 {name}: {SCALES[name]}")
+            data_dir = os.path.join(work_dir, name)
+            results['results'].extend(run_scale(name, data_dir, pages, backtest))
+            shutil.rmtree(data_dir, ignore_errors=True)
+    finally:
+        tracemalloc.stop()
+
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"計測結果を保存しました: {out_path}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='合成データで読み込み・各ページの集計・描画の処理時間とメモリを計測します'
+    )
+    parser.add_argument('--scale', action='append', choices=list(SCALES),
+                        help='データ規模（複数指定可、既定: small）')
+    parser.add_argument('--out', default='benchmark.json', help='結果のJSONファイル（既定: benchmark.json）')
+    parser.add_argument('--work-dir', help='合成データの作成先（既定: 一時ディレクトリ）')
+    parser.add_argument('--no-pages', action='store_true', help='ページ単位（AppTest）の計測を省略')
+    parser.add_argument('--backtest', action='store_true', help='バックテストも計測')
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    run_benchmarks(args.scale or ['small'], args.out, args.work_dir, not args.no_pages, args.backtest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from tracing import configure_logging, process_pool, span
+
+# matplotlib・seaborn・japanize_matplotlibは読み込みに時間がかかるため、
+# 起動時には読み込まず、サーバーで最初にグラフを描画するときに読み込む
+
+# st.pyplotと同じ解像度で描画する
+FIGURE_DPI = 200
+
+# 描画済みグラフのキャッシュの上限（MB）
+FIGURE_CACHE_MB = int(os.environ.get('ATM_FIGURE_CACHE_MB', '64'))
+
+# 複数のグラフをまとめて描画するときの設定（ATM_RENDER_EXECUTORはprocessまたはserial）
+RENDER_EXECUTOR = os.environ.get('ATM_RENDER_EXECUTOR', 'process')
+RENDER_WORKERS = int(os.environ.get('ATM_RENDER_WORKERS', '0')) or None
+
+# 日本語を表示するためのフォント設定
+FONT_SETTINGS = {
+    'font.family': 'IPAexGothic',
+    'font.sans-serif': ['IPAexGothic', 'MS Gothic', 'Hiragino Maru Gothic Pro', 'Yu Gothic'],
+    'axes.unicode_minus': False,
+    'font.size': 12,
+    'axes.labelsize': 12,
+    'xtick.labelsize': 10,
+    'ytick.labelsize': 10,
+    'legend.fontsize': 10
+}
+
+# グラフの描画方法（サーバーで画像にするか、集計データだけを送ってブラウザで描くか）
+BACKEND_MATPLOTLIB = 'サーバーで描画（画像）'
+BACKEND_VEGA_LITE = 'ブラウザで描画（Vega-Lite）'
+CHART_BACKENDS = [BACKEND_MATPLOTLIB, BACKEND_VEGA_LITE]
+DEFAULT_CHART_BACKEND = (
+    BACKEND_VEGA_LITE if os.environ.get('ATM_CHART_BACKEND') == 'vega-lite' else BACKEND_MATPLOTLIB
+)
+
+# matplotlibのカラーマップに対応するVega-Liteの配色
+VEGA_SCHEMES = {'Blues': 'blues', 'Greens': 'greens', 'YlOrRd': 'yelloworangered'}
+
+# Vega-Liteのグラフの高さ（matplotlibの図の高さ1インチあたりのピクセル数）
+VEGA_PIXELS_PER_INCH = 60
+
+
+class ChartSpec:
+    """グラフの種類・集計済みのデータ・表示設定
+
+    kindはbar（dataはSeries）、line（dataは列ごとに1本の線のDataFrame）、
+    heatmap（dataは行×列の表）のいずれか。データは集計済みの小さな表だけを
+    持つため、そのまま別プロセスに渡して描画できる。
+    """
+
+    def __init__(self, kind, data, title=None, xlabel=None, ylabel=None, size=(6, 4), **options):
+        self.kind = kind
+        self.data = data
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.size = size
+        self.options = options
+
+
+def _comma(x, _pos):
+    return f'{int(x):,}'
+
+
+def _draw_bar(ax, spec):
+    data = spec.data
+    bars = ax.bar(data.index, data.values)
+
+    # 値の大小に応じた濃淡で塗り分ける
+    shade = spec.options.get('shade')
+    if shade:
+        import matplotlib
+        low, high = data.min(), data.max()
+        cmap = matplotlib.colormaps[shade]
+        for bar, value in zip(bars, data.values):
+            level = (value - low) / (high - low) if high != low else 0.5
+            bar.set_color(cmap(0.3 + level * 0.5))
+
+    if 'xticks' in spec.options:
+        ax.set_xticks(spec.options['xticks'])
+        ax.set_xticklabels(spec.options['xticklabels'])
+
+
+def _draw_line(ax, spec):
+    styles = spec.options.get('styles', {})
+    for name in spec.data.columns:
+        style = {'marker': 'o', **styles.get(name, {})}
+        ax.plot(list(spec.data.index), spec.data[name].values, label=name, **style)
+    if spec.options.get('legend', True) and len(spec.data.columns) > 1:
+        ax.legend()
+
+
+def _draw_heatmap(ax, spec):
+    import seaborn as sns
+    sns.heatmap(spec.data, cmap=spec.options.get('cmap', 'YlOrRd'), annot=spec.options.get('annot', True),
+                fmt=spec.options.get('fmt', '.1f'), cbar_kws={'label': spec.options.get('colorbar_label', '')},
+                ax=ax)
+
+
+_DRAW = {'bar': _draw_bar, 'line': _draw_line, 'heatmap': _draw_heatmap}
+
+
+def render_png(spec):
+    """グラフの仕様をPNGのバイト列に描画
+
+    pyplotのグローバルな状態を使わずにFigureを直接作るため、
+    ページの他の描画の影響を受けない。
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import FuncFormatter
+
+    configure_fonts()
+    with span('render', kind=spec.kind, title=spec.title or ''):
+        fig = Figure(figsize=spec.size)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        _DRAW[spec.kind](ax, spec)
+
+        if spec.title:
+            ax.set_title(spec.title)
+        if spec.xlabel:
+            ax.set_xlabel(spec.xlabel)
+        if spec.ylabel:
+            ax.set_ylabel(spec.ylabel)
+        if spec.options.get('yformat') == 'comma':
+            ax.yaxis.set_major_formatter(FuncFormatter(_comma))
+        grid = spec.options.get('grid')
+        if grid == 'y':
+            ax.grid(True, axis='y', linestyle='--', alpha=0.7)
+        elif grid:
+            ax.grid(True)
+        if spec.options.get('rotate'):
+            ax.tick_params(axis='x', labelrotation=spec.options['rotate'])
+        fig.tight_layout()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=FIGURE_DPI, bbox_inches='tight')
+        return buf.getvalue()
+
+
+def _axis(title, spec, x_axis):
+    grid = spec.options.get('grid')
+    axis = {'title': title, 'grid': grid is True or (grid == 'y' and not x_axis)}
+    if x_axis and spec.options.get('rotate'):
+        axis['labelAngle'] = -spec.options['rotate']
+    if not x_axis and spec.options.get('yformat') == 'comma':
+        axis['format'] = ',d'
+    return axis
+
+
+def _vega_bar(spec):
+    data = spec.data
+    labels = dict(zip(spec.options.get('xticks', []), spec.options.get('xticklabels', [])))
+    frame = pd.DataFrame({
+        'x': [labels.get(x, str(x)) for x in data.index],
+        'y': data.values
+    })
+    encoding = {
+        # sort=Noneでデータの順序（時間帯・支店の並び）のまま表示
+        'x': {'field': 'x', 'type': 'ordinal', 'sort': None, 'axis': _axis(spec.xlabel, spec, True)},
+        'y': {'field': 'y', 'type': 'quantitative',
+              'axis': _axis(spec.ylabel, spec, False)},
+        'tooltip': [{'field': 'x', 'title': spec.xlabel}, {'field': 'y', 'title': spec.ylabel}]
+    }
+    shade = spec.options.get('shade')
+    if shade:
+        encoding['color'] = {'field': 'y', 'type': 'quantitative', 'legend': None,
+                             'scale': {'scheme': VEGA_SCHEMES.get(shade, shade)}}
+    return frame, {'mark': 'bar', 'encoding': encoding}
+
+
+def _vega_line(spec):
+    data = spec.data
+    frame = pd.DataFrame({
+        'x': np.tile(np.asarray(data.index, dtype=str), len(data.columns)),
+        'series': np.repeat(np.asarray(data.columns, dtype=str), len(data.index)),
+        'value': np.concatenate([data[name].to_numpy(dtype=float) for name in data.columns])
+    })
+    styles = spec.options.get('styles', {})
+    names = [str(name) for name in data.columns]
+    dashed = [name for name in names if styles.get(name, {}).get('linestyle') == '--']
+    marked = [name for name in names if styles.get(name, {}).get('marker', 'o') is not None]
+
+    encoding = {
+        'x': {'field': 'x', 'type': 'ordinal', 'sort': None, 'axis': _axis(spec.xlabel, spec, True)},
+        'y': {'field': 'value', 'type': 'quantitative',
+              'axis': _axis(spec.ylabel, spec, False)},
+        'color': {'field': 'series', 'type': 'nominal', 'sort': names, 'title': None,
+                  'legend': {} if spec.options.get('legend', True) and len(names) > 1 else None},
+        'tooltip': [{'field': 'x', 'title': spec.xlabel}, {'field': 'series', 'title': '系列'},
+                    {'field': 'value', 'title': spec.ylabel, 'format': ',.1f'}]
+    }
+    line = {'mark': 'line'}
+    if dashed:
+        line['encoding'] = {'strokeDash': {
+            'field': 'series', 'type': 'nominal', 'legend': None,
+            'scale': {'domain': names, 'range': [[6, 4] if name in dashed else [1, 0] for name in names]}
+        }}
+    points = {'mark': {'type': 'point', 'filled': True},
+              'transform': [{'filter': {'field': 'series', 'oneOf': marked}}]}
+    return frame, {'encoding': encoding, 'layer': [line, points] if marked else [line]}
+
+
+def _vega_heatmap(spec):
+    data = spec.data
+    frame = pd.DataFrame({
+        'row': np.repeat(np.asarray(data.index, dtype=str), len(data.columns)),
+        'col': np.tile(np.asarray(data.columns, dtype=str), len(data.index)),
+        'value': data.to_numpy(dtype=float).ravel()
+    })
+    # 値の注記は描かず、マウスを重ねたときに表示する
+    encoding = {
+        'x': {'field': 'col', 'type': 'ordinal', 'sort': None, 'axis': _axis(spec.xlabel, spec, True)},
+        'y': {'field': 'row', 'type': 'ordinal', 'sort': None, 'axis': _axis(spec.ylabel, spec, False)},
+        'color': {'field': 'value', 'type': 'quantitative',
+                  'title': spec.options.get('colorbar_label') or None,
+                  'scale': {'scheme': VEGA_SCHEMES.get(spec.options.get('cmap', 'YlOrRd'), 'yelloworangered')}},
+        'tooltip': [{'field': 'col', 'title': spec.xlabel}, {'field': 'row', 'title': spec.ylabel},
+                    {'field': 'value', 'title': spec.options.get('colorbar_label') or '値', 'format': '.1f'}]
+    }
+    return frame, {'mark': 'rect', 'encoding': encoding}
+
+
+_VEGA = {'bar': _vega_bar, 'line': _vega_line, 'heatmap': _vega_heatmap}
+
+
+def vega_lite_spec(spec):
+    """グラフの仕様をVega-Liteの(データ, 仕様)に変換
+
+    ブラウザには集計済みのデータだけを列名x/y/series/value等の縦持ちで渡す。
+    """
+    frame, chart = _VEGA[spec.kind](spec)
+    chart['height'] = int(spec.size[1] * VEGA_PIXELS_PER_INCH)
+    if spec.title:
+        chart['title'] = spec.title
+    return frame, chart
+
+
+_fonts_configured = False
+
+
+def configure_fonts():
+    """日本語フォントを設定（プロセスごとに最初の一度だけ行う）"""
+    global _fonts_configured
+    if _fonts_configured:
+        return
+    import japanize_matplotlib  # noqa: F401  IPAexGothicを登録する
+    import matplotlib
+    matplotlib.rcParams.update(FONT_SETTINGS)
+    _fonts_configured = True
+
+
+def _init_worker():
+    # 描画用ワーカーのログ（区間の処理時間）はワーカー側で出力する
+    configure_logging()
+    configure_fonts()
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _pool():
+    # ワーカーの起動とフォントの読み込みは一度だけ行い、以降は使い回す
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = process_pool(RENDER_WORKERS, initializer=_init_worker)
+        return _render_pool
+
+
+def render_many(specs, executor=None):
+    """複数のグラフの仕様をPNGのバイト列に描画し、同じ順序で返す
+
+    pyplotの状態はプロセスごとに独立しているため、プロセスプールで
+    並列に描画する。1枚だけの場合はプールを使わない。
+    """
+    specs = list(specs)
+    if (executor or RENDER_EXECUTOR) != 'process' or len(specs) <= 1:
+        return [render_png(spec) for spec in specs]
+    with span('render_many', figures=len(specs)):
+        return list(_pool().map(render_png, specs))
+
+
+class FigureCache:
+    """描画済みのグラフ（PNG）を保持するサイズ上限付きのLRUキャッシュ
+
+    キーは(ページ, グラフ, 支店, 月, 表示設定, データのバージョン)とし、
+    データが更新されるとバージョンが変わるため古い画像は使われずに
+    追い出される。
+    """
+
+    def __init__(self, max_bytes=FIGURE_CACHE_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render_many(self, items):
+        """(キー, build)の並びについて画像を返す（キャッシュにないものはまとめて並列に描画）"""
+        with self._lock:
+            images = [self._images.get(key) for key, _ in items]
+            for (key, _), image in zip(items, images):
+                if image is not None:
+                    self._images.move_to_end(key)
+                    self.hits += 1
+
+        missing = [i for i, image in enumerate(images) if image is None]
+        rendered = render_many(items[i][1]() for i in missing)
+        for i, image in zip(missing, rendered):
+            self.put(items[i][0], image)
+            images[i] = image
+        return images
+
+    def put(self, key, image):
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._images[key] = image
+            self._bytes += len(image)
+            self.misses += 1
+            # 上限を超えたら最も長く使われていない画像から破棄
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        """ヒット数・ミス数・画像数・合計サイズを返す"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._images),
+                'bytes': self._bytes
+            }
+
+    def clear(self):
+        """キャッシュと統計をすべて破棄"""
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# プロセス全体で共有する描画済みグラフのキャッシュ
+FIGURE_CACHE = FigureCache()
+
+
+def show_charts(items):
+    """複数のグラフを順に表示（(キー, build)の並び、未描画の画像は並列に描画）
+
+    サイドバーでブラウザ描画が選ばれている場合はVega-Liteで表示する。
+    """
+    if st.session_state.get('chart_backend', DEFAULT_CHART_BACKEND) == BACKEND_VEGA_LITE:
+        for _, build in items:
+            spec = build()
+            with span('render', kind=spec.kind, title=spec.title or '', backend='vega-lite'):
+                frame, chart = vega_lite_spec(spec)
+            st.vega_lite_chart(frame, chart, use_container_width=True)
+        return
+    for image in FIGURE_CACHE.get_or_render_many(list(items)):
+        st.image(image, use_column_width=True)
+
+
+def show_chart(key, build):
+    """グラフを表示（同じキーの描画済み画像があれば再描画しない）
+
+    buildはChartSpecを返す関数で、キャッシュにない場合だけ呼ばれる。
+    """
+    show_charts([(key, build)])
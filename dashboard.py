@@ -1,144 +1,124 @@
+import time
+
+# スクリプトの実行開始時刻（最初の表示までの時間の計測に使う）
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
-from datetime import datetime, timedelta
-import japanize_matplotlib
+import logging
+from data_loader import CASH_FLOW_FILE_KINDS, DATASET_CACHE, scan_data_dir
+from charts import CHART_BACKENDS, DEFAULT_CHART_BACKEND, show_chart, show_charts
+from data_views import DAILY_FLOW_VIEW, FLOW_TOTAL, daily_flow_table, memory_report
+from forecast import (BACKTEST_HORIZONS, BACKTEST_STEP, METHOD_MODEL, METHOD_SAME_CLASS, MOVING_AVERAGE_DAYS,
+                      SPECIAL_DAY_NAMES, backtest, backtest_summary, forecast_table, hourly_profile)
+from page_data import (BILL_VALUES, COIN_VALUES, DENOMINATION_LABELS, atm_months, balances_chart, branch_entry,
+                       cash_flow_summary, comparison_table, daily_balance, daily_balance_chart, daily_denomination_means,
+                       day_labels, demo_branch, denomination_flow_frame, denomination_summary, denomination_trend_chart,
+                       flow_comparison, flow_months, flows_chart, forecast_chart, forecast_column, hourly_deposits,
+                       hourly_deposits_chart, hourly_heatmap, hourly_heatmap_chart, money_type_columns,
+                       month_cash_flows, overview_summary, transactions_chart)
+from tracing import configure_logging, current_recorder, span, start_recording
 
-# フォント設定を更新
-plt.rcParams['font.family'] = 'IPAexGothic'  # MS Gothicから変更
-plt.rcParams['font.sans-serif'] = ['IPAexGothic', 'MS Gothic', 'Hiragino Maru Gothic Pro', 'Yu Gothic']
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams['font.size'] = 12
-plt.rcParams['axes.labelsize'] = 12
-plt.rcParams['xtick.labelsize'] = 10
-plt.rcParams['ytick.labelsize'] = 10
-plt.rcParams['legend.fontsize'] = 10
+logger = logging.getLogger(__name__)
 
-# 日本語の曜日マッピング
-WEEKDAY_MAP = {
-    'Monday': '月',
-    'Tuesday': '火',
-    'Wednesday': '水',
-    'Thursday': '木',
-    'Friday': '金',
-    'Saturday': '土',
-    'Sunday': '日'
-}
+# 起動時間の目標（秒）：スクリプトの開始からページの骨組み（タイトル・サイドバー）の表示まで
+STARTUP_BUDGET_SECONDS = float(os.environ.get('ATM_STARTUP_BUDGET', '1.0'))
+
+# データファイルが見つからない場合（デモデータ）の支店コード
+DEFAULT_BRANCH_CODES = ['00512', '00524', '00525', '00609', '00616',
+                        '00643', '00669', '00748', '00796']
 
 class ATMDashboard:
     def __init__(self):
         try:
             self.base_dir = os.getcwd()
-            print(f"作業ディレクトリ: {self.base_dir}")
+            logger.debug("作業ディレクトリ: %s", self.base_dir)
             
-            # 支店コードの定義
-            self.branch_codes = ['00512', '00524', '00525', '00609', '00616', 
-                               '00643', '00669', '00748', '00796']
+            # データディレクトリの索引から支店コードを取得
+            self.catalog = scan_data_dir(self.base_dir)
+            self.branch_codes = self.catalog.branch_codes or DEFAULT_BRANCH_CODES
+            logger.debug("検出された支店: %s件", len(self.catalog.branch_codes))
             
             # 金種の定義
-            self.bills = {
-                '10000': '10000円札',
-                '5000': '5000円札',
-                '2000': '2000円札',
-                '1000': '1000円札'
-            }
-            
-            self.coins = {
-                '500': '500円',
-                '100': '100円',
-                '50': '50円',
-                '10': '10円',
-                '5': '5円',
-                '1': '1円'
-            }
+            self.bills = {value: DENOMINATION_LABELS[value] for value in BILL_VALUES}
+            self.coins = {value: DENOMINATION_LABELS[value] for value in COIN_VALUES}
             
             self.branch_data = {}
             self.cash_flow_data = {}  # 現金フローデータを保存
             
-            # データの読み込みを試行
-            try:
-                self.load_data()
-            except Exception as e:
-                print(f"データ読み込みエラー: {str(e)}")
-                print("デモデータを使用します")
-                self.create_demo_data()
-            
-            try:
-                self.load_cash_flow_data()  # 現金フローデータの読み込み
-            except Exception as e:
-                print(f"現金フローデータ読み込みエラー: {str(e)}")
-                print("デモデータを使用します")
-                self.create_demo_cash_flow_data()
-            
-            print("データ読み込み完了")
-            
-            # ページ設定
+            # ページの骨組みはデータの読み込みを待たずに表示
             self.setup_page()
+            self.record_startup('first_paint')
+            
+            stats_before = DATASET_CACHE.stats()
+            with st.spinner('データを読み込んでいます...'):
+                # データの読み込みを試行
+                try:
+                    self.load_data()
+                except Exception as e:
+                    logger.warning("データ読み込みエラー: %s", e)
+                    logger.debug("デモデータを使用します")
+                    self.create_demo_data()
+                
+                try:
+                    self.load_cash_flow_data()  # 現金フローデータの読み込み
+                except Exception as e:
+                    logger.warning("現金フローデータ読み込みエラー: %s", e)
+                    logger.debug("デモデータを使用します")
+                    self.create_demo_cash_flow_data()
+            self.record_startup('data_ready')
+            
+            # 再実行のたびに出力しないよう、ファイルを読み込んだ場合だけINFOで出力
+            cache_stats = DATASET_CACHE.stats()
+            loaded = any(cache_stats[key] > stats_before[key] for key in ('sidecar_hits', 'misses', 'appends'))
+            logger.log(logging.INFO if loaded else logging.DEBUG,
+                       "データ読み込み完了（キャッシュ ヒット: %s件, サイドカー: %s件, ミス: %s件）",
+                       cache_stats['hits'], cache_stats['sidecar_hits'], cache_stats['misses'])
             
         except Exception as e:
-            print(f"初期化エラー: {str(e)}")
+            logger.exception("初期化エラー: %s", e)
             st.error(f"データの読み込みに失敗しました: {str(e)}")
             self.branch_data = {}
             self.cash_flow_data = {}
             self.create_demo_data()
             self.create_demo_cash_flow_data()
-            self.setup_page()
+            if not hasattr(self, 'page'):
+                self.setup_page()
+
+    def record_startup(self, stage):
+        """スクリプトの開始からの経過時間を記録（最初の表示は目標時間と比較）"""
+        elapsed = time.perf_counter() - SCRIPT_STARTED
+        timing = st.session_state.setdefault('startup_timing', {'budget': STARTUP_BUDGET_SECONDS})
+        timing[stage] = elapsed
+        logger.debug("起動時間（%s）: %.2f秒", stage, elapsed)
+        if stage == 'first_paint' and elapsed > STARTUP_BUDGET_SECONDS:
+            logger.warning("最初の表示までの時間が目標（%.1f秒）を超えました: %.2f秒", STARTUP_BUDGET_SECONDS, elapsed)
 
     def load_data(self):
         """データの読み込み"""
+        # ATM精算データのファイルを特定
+        tasks = {}
         for code in self.branch_codes:
+            atm_path = self.catalog.settlement_path(code)
+            if atm_path:
+                tasks[code] = (atm_path, 'atm')
+        
+        # 支店ごとのファイルを並列に読み込む
+        results = DATASET_CACHE.load_many(list(tasks.values()))
+        
+        for code, task in tasks.items():
             try:
-                # ATM精算データ
-                atm_files = [f for f in os.listdir(self.base_dir) if f.startswith(f"{code}_ATM精算")]
-                if atm_files:
-                    atm_path = os.path.join(self.base_dir, atm_files[0])
-                    print(f"読み込むファイル: {atm_path}")
-                    try:
-                        atm_df = pd.read_csv(atm_path, encoding='utf-8')
-                    except UnicodeDecodeError:
-                        try:
-                            atm_df = pd.read_csv(atm_path, encoding='cp932')
-                        except UnicodeDecodeError:
-                            atm_df = pd.read_csv(atm_path, encoding='shift-jis')
-                    
-                    # 日付と時刻の変換
-                    atm_df['日付'] = pd.to_datetime(atm_df['日付'].astype(str), format='%Y%m%d')
-                    atm_df['曜日'] = atm_df['日付'].dt.day_name().map(WEEKDAY_MAP)
-                    
-                    # 時刻の処理
-                    atm_df['時刻'] = atm_df['時刻'].astype(str).str.zfill(6)
-                    atm_df['時刻'] = pd.to_datetime(atm_df['時刻'], format='%H%M%S').dt.time
-                    
-                    # 金種データの列を特定
-                    bill_cols = []
-                    coin_cols = []
-                    
-                    # 紙幣の列を検索
-                    for bill_value in self.bills.keys():
-                        col_pattern = f'ATM現金（手入力以外）入金（{bill_value}円）枚数'
-                        matching_cols = [col for col in atm_df.columns if col.replace(' ', '') == col_pattern.replace(' ', '')]
-                        if matching_cols:
-                            bill_cols.extend(matching_cols)
-                    
-                    # 硬貨の列を検索
-                    for coin_value in self.coins.keys():
-                        col_pattern = f'ATM現金（手入力以外）入金（{coin_value}円）枚数'
-                        matching_cols = [col for col in atm_df.columns if col.replace(' ', '') == col_pattern.replace(' ', '')]
-                        if matching_cols:
-                            coin_cols.extend(matching_cols)
-                    
-                    self.branch_data[code] = {
-                        'atm_df': atm_df,
-                        'bill_cols': bill_cols,
-                        'coin_cols': coin_cols
-                    }
-                    print(f"支店{code}のデータを読み込みました")
-                    
+                atm_df = results[task]
+                if isinstance(atm_df, Exception):
+                    raise atm_df
+                
+                # 金種データの列を特定し、集計キューブと一緒に保持
+                self.branch_data[code] = branch_entry(atm_df)
+                logger.debug("支店%sのデータを読み込みました", code)
+                
             except Exception as e:
-                print(f"支店{code}のデータ読み込みでエラー: {str(e)}")
+                logger.warning("支店%sのデータ読み込みでエラー: %s", code, e)
                 continue
         
         if not self.branch_data:
@@ -146,78 +126,39 @@ class ATMDashboard:
 
     def load_cash_flow_data(self):
         """現金フローデータの読み込み"""
+        # 各データタイプのファイル
+        tasks = []
         for code in self.branch_codes:
-            try:
-                data_frames = {}
-                
-                # 各データタイプの読み込み
-                file_patterns = {
-                    'pos_withdrawal': f"{code}_元金補充POSレジ出金確定データ.csv",
-                    'bank_deposit': f"{code}_銀行預入出金確定データ.csv",
-                    'bank_exchange': f"{code}_銀行両替金入金確定データ.csv",
-                    'atm_settlement': f"{code}_ATM精算POSレジ自動釣銭機確定データ.csv"
-                }
-                
-                for key, filename in file_patterns.items():
-                    try:
-                        file_path = os.path.join(self.base_dir, filename)
-                        if os.path.exists(file_path):
-                            print(f"読み込み中: {file_path}")
-                            try:
-                                df = pd.read_csv(file_path, encoding='utf-8')
-                            except UnicodeDecodeError:
-                                try:
-                                    df = pd.read_csv(file_path, encoding='cp932')
-                                except UnicodeDecodeError:
-                                    df = pd.read_csv(file_path, encoding='shift-jis')
-                            
-                            # 日付の変換
-                            if '日付' in df.columns:
-                                df['日付'] = pd.to_datetime(df['日付'].astype(str).str.strip(), format='%Y%m%d')
-                            
-                            # 金種関連の列名を正規化
-                            amount_cols = [col for col in df.columns if ('枚数' in col or '金額' in col)]
-                            print(f"検出された金種関連の列: {amount_cols}")
-                            
-                            # 金種ごとの列名を変更
-                            for col in amount_cols:
-                                if '枚数' in col:
-                                    col_clean = col.replace(' ', '')  # スペースを除去
-                                    for value in list(self.bills.keys()) + list(self.coins.keys()):
-                                        if str(value) in col_clean:
-                                            if key == 'pos_withdrawal':
-                                                new_col = f'出金枚数_{value}円'
-                                            elif key == 'bank_deposit':
-                                                new_col = f'預入枚数_{value}円'
-                                            elif key == 'bank_exchange':
-                                                new_col = f'両替枚数_{value}円'
-                                            elif key == 'atm_settlement':
-                                                new_col = f'精算枚数_{value}円'
-                                            
-                                            df[new_col] = df[col]
-                                            print(f"列名を変更: {col} -> {new_col}")
-                                            break
-                            
-                            data_frames[key] = df
-                        else:
-                            print(f"ファイルが見つかりません: {filename}")
-                            
-                    except Exception as e:
-                        print(f"ファイル {filename} の読み込みエラー: {str(e)}")
-                        continue
-                
-                if data_frames:
-                    self.cash_flow_data[code] = data_frames
-                    print(f"支店{code}の現金フローデータを読み込みました")
+            for key, data_type in CASH_FLOW_FILE_KINDS.items():
+                file_path = self.catalog.path(code, data_type)
+                if file_path:
+                    tasks.append((file_path, key))
                 else:
-                    print(f"支店{code}の現金フローデータが読み込めませんでした")
-            
-            except Exception as e:
-                print(f"支店{code}の現金フローデータ読み込みエラー: {str(e)}")
-                continue
+                    logger.warning("ファイルが見つかりません: %s_%s.csv", code, data_type)
+        
+        # すべての支店・データタイプのファイルを並列に読み込む
+        results = DATASET_CACHE.load_many(tasks)
+        
+        # 支店コード順・データタイプ順に結果をまとめる
+        for code in self.branch_codes:
+            data_frames = {}
+            for key, data_type in CASH_FLOW_FILE_KINDS.items():
+                task = (self.catalog.path(code, data_type), key)
+                if task not in results:
+                    continue
+                if isinstance(results[task], Exception):
+                    logger.warning("ファイル %s_%s.csv の読み込みエラー: %s", code, data_type, results[task])
+                    continue
+                data_frames[key] = results[task]
+            
+            if data_frames:
+                self.cash_flow_data[code] = data_frames
+                logger.debug("支店%sの現金フローデータを読み込みました", code)
+            else:
+                logger.warning("支店%sの現金フローデータが読み込めませんでした", code)
         
         if not self.cash_flow_data:
-            print("現金フローデータが読み込めませんでした。デモデータを使用します。")
+            logger.warning("現金フローデータが読み込めませんでした。デモデータを使用します。")
             self.create_demo_cash_flow_data()
 
     def setup_page(self):
@@ -232,7 +173,7 @@ class ATMDashboard:
             # セッションステートの初期化
             if 'page' not in st.session_state:
                 st.session_state.page = '概要'
-                print("ページ状態を初期化: 概要")
+                logger.debug("ページ状態を初期化: 概要")
             
             # ページ選択
             self.page = st.sidebar.radio(
@@ -242,10 +183,21 @@ class ATMDashboard:
                 label_visibility='collapsed'
             )
             
-            print(f"現在のページ: {self.page}")
+            logger.debug("現在のページ: %s", self.page)
+            
+            # グラフの描画方法（show_chartがセッションステートから参照）
+            st.sidebar.radio(
+                'グラフの描画方法',
+                CHART_BACKENDS,
+                index=CHART_BACKENDS.index(DEFAULT_CHART_BACKEND),
+                key='chart_backend'
+            )
+            
+            # この再実行の処理時間の内訳（run()の最後に表示）
+            st.sidebar.checkbox('プロファイラを表示', key='show_profiler')
             
         except Exception as e:
-            print(f"ページ設定エラー: {str(e)}")
+            logger.warning("ページ設定エラー: %s", e)
             # デフォルト値の設定
             self.page = '概要'
             st.error("ページの初期化中にエラーが発生しました。デフォルトページを表示します。")
@@ -273,10 +225,9 @@ class ATMDashboard:
             
             if selected_branch in self.branch_data:
                 data = self.branch_data[selected_branch]
-                df = data['atm_df']
                 
                 # 月選択
-                available_months = df['日付'].dt.to_period('M').unique()
+                available_months = atm_months(data)
                 if len(available_months) == 0:
                     st.error("選択された支店の月別データがありません。")
                     return
@@ -287,23 +238,22 @@ class ATMDashboard:
                     format_func=lambda x: f"{x.year}年{x.month}月"
                 )
                 
-                # 選択された月のデータでフィルタリング
-                df_filtered = df[df['日付'].dt.to_period('M') == selected_month]
+                # 事前集計したキューブから選択された月を集計
+                cube = data['cube']
+                summary = overview_summary(cube, selected_month)
                 
-                if len(df_filtered) == 0:
+                if summary['取引件数'] == 0:
                     st.warning(f"選択された月（{selected_month}）のデータがありません。")
                     return
                 
                 # 基本統計
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric('取引件数', f"{len(df_filtered):,}件")
+                    st.metric('取引件数', f"{summary['取引件数']:,}件")
                 with col2:
-                    avg_balance = df_filtered['在高合計金額'].mean()
-                    st.metric('平均在高金額', f"{int(avg_balance):,}円")
+                    st.metric('平均在高金額', f"{int(summary['平均在高金額']):,}円")
                 with col3:
-                    max_balance = df_filtered['在高合計金額'].max()
-                    st.metric('最大在高金額', f"{int(max_balance):,}円")
+                    st.metric('最大在高金額', f"{int(summary['最大在高金額']):,}円")
                 
                 # グラフを横並びに配置
                 col_left, col_right = st.columns(2)
@@ -311,27 +261,12 @@ class ATMDashboard:
                 with col_left:
                     # 時間帯別取引数
                     st.subheader('時間帯別ATM現金入金取引数')
-                    df_filtered['hour'] = pd.to_datetime(df_filtered['時刻'].astype(str)).dt.hour
                     
                     # ATM現金入金取引のみを集計（入金額が0より大きい取引）
-                    df_filtered['ATM現金入金取引'] = (df_filtered['ATM現金入金計金額'] > 0).astype(int)
-                    hourly_counts = df_filtered.groupby('hour')['ATM現金入金取引'].sum()
-                    
-                    fig, ax = plt.subplots(figsize=(6, 4))
-                    ax.bar(hourly_counts.index, hourly_counts.values)
-                    ax.set_xlabel('時間帯')
-                    ax.set_ylabel('ATM現金入金取引数（件）')
-                    
-                    # X軸の目盛りを設定（0-23時）
-                    ax.set_xticks(range(24))
-                    ax.set_xticklabels([f'{h}時' for h in range(24)])
-                    plt.xticks(rotation=45)
-                    
-                    # グリッド線を追加
-                    plt.grid(True, axis='y', linestyle='--', alpha=0.7)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
+                    show_chart(
+                        ('概要', 'hourly', selected_branch, str(selected_month), (), cube.version),
+                        lambda: hourly_deposits_chart(hourly_deposits(cube, selected_month))
+                    )
                     
                     # データソースの説明を追加
                     st.markdown(f"""
@@ -345,25 +280,11 @@ class ATMDashboard:
                 with col_right:
                     # 日別推移
                     st.subheader('日別在高金額推移')
-                    daily_balance = df_filtered.groupby(['日付', '曜日'])['在高合計金額'].mean().reset_index()
-                    fig, ax = plt.subplots(figsize=(6, 4))
-                    # 百万円単位に変換
-                    daily_balance['在高合計金額_百万円'] = daily_balance['在高合計金額'] / 1_000_000
-                    ax.plot(daily_balance['日付'], daily_balance['在高合計金額_百万円'], marker='o')
-                    ax.set_xlabel('日付')
-                    ax.set_ylabel('在高金額（百万円）')
-                    
-                    # Y軸のフォーマットを設定
-                    ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{int(x):,}'))
-                    
-                    # X軸の日付フォーマットを設定
-                    plt.xticks(daily_balance['日付'], 
-                             [f"{d.strftime('%m/%d')}({w})" for d, w in zip(daily_balance['日付'], daily_balance['曜日'])],
-                             rotation=45)
-                    plt.grid(True)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
+                    # 百万円単位に変換し、日付と曜日のラベルで表示
+                    show_chart(
+                        ('概要', 'daily_balance', selected_branch, str(selected_month), (), cube.version),
+                        lambda: daily_balance_chart(daily_balance(cube, selected_month))
+                    )
                     
                     # データソースの説明を追加
                     st.markdown(f"""
@@ -376,7 +297,7 @@ class ATMDashboard:
         
         except Exception as e:
             st.error(f"データの表示中にエラーが発生しました: {str(e)}")
-            print(f"エラーの詳細: {str(e)}")
+            logger.exception("エラーの詳細: %s", e)
             if not self.branch_data:
                 st.warning("データが読み込まれていません。デモデータを使用します。")
                 self.create_demo_data()
@@ -404,10 +325,9 @@ class ATMDashboard:
             
             if selected_branch in self.branch_data:
                 data = self.branch_data[selected_branch]
-                df = data['atm_df']
                 
                 # 月選択
-                available_months = df['日付'].dt.to_period('M').unique()
+                available_months = atm_months(data)
                 if len(available_months) == 0:
                     st.error("選択された支店の月別データがありません。")
                     return
@@ -418,24 +338,18 @@ class ATMDashboard:
                     format_func=lambda x: f"{x.year}年{x.month}月"
                 )
                 
-                # 選択された月のデータでフィルタリング
-                df_filtered = df[df['日付'].dt.to_period('M') == selected_month]
+                # 事前集計したキューブを使用
+                cube = data['cube']
                 
-                if len(df_filtered) == 0:
+                if cube.row_count(selected_month) == 0:
                     st.warning(f"選択された月（{selected_month}）のデータがありません。")
                     return
                 
                 # 表示する金種の選択
                 money_type = st.radio('金種タイプ', ['紙幣', '硬貨'])
                 
-                if money_type == '紙幣':
-                    cols = data['bill_cols']
-                    title = '紙幣種別の推移'
-                    labels = {col: f"{col.split('（')[2].split('円')[0]}円札" for col in cols}
-                else:
-                    cols = data['coin_cols']
-                    title = '硬貨種別の推移'
-                    labels = {col: f"{col.split('（')[2].split('円')[0]}円玉" for col in cols}
+                cols, labels = money_type_columns(data, money_type)
+                title = f'{money_type}種別の推移'
                 
                 if not cols:
                     st.warning(f'{money_type}のデータが見つかりません。')
@@ -443,22 +357,12 @@ class ATMDashboard:
                 
                 # 金種別推移グラフ
                 st.subheader(title)
-                fig, ax = plt.subplots(figsize=(12, 6))
-                
-                # 日付と曜日でグループ化してプロット
-                df_filtered['date_str'] = df_filtered['日付'].dt.strftime('%m/%d') + '(' + df_filtered['曜日'] + ')'
-                for col in cols:
-                    daily_values = df_filtered.groupby('date_str')[col].mean()
-                    ax.plot(daily_values.index, daily_values.values, label=labels[col], marker='o')
                 
-                ax.set_xlabel('日付')
-                ax.set_ylabel('枚数')
-                ax.legend()
-                plt.xticks(rotation=45)
-                plt.grid(True)
-                plt.tight_layout()
-                st.pyplot(fig)
-                plt.close()
+                # 日付と曜日のラベルで日別平均をプロット
+                show_chart(
+                    ('金種別分析', 'trend', selected_branch, str(selected_month), (money_type,), cube.version),
+                    lambda: denomination_trend_chart(daily_denomination_means(cube, selected_month, cols, labels))
+                )
                 
                 # データソースの説明を追加
                 st.markdown(f"""
@@ -469,42 +373,36 @@ class ATMDashboard:
                 - 集計方法: 日別・金種別の平均入金枚数
                 """)
                 
-                # 時間帯別ヒートマップ
+                # 時間帯別ヒートマップ（金種ごとの概要を先に表示し、選択した金種だけを描画）
                 st.subheader(f'時間帯別{money_type}取扱枚数')
                 
-                # 時刻を時間に変換
-                df_filtered['hour'] = pd.to_datetime(df_filtered['時刻'].astype(str)).dt.hour
+                summary = denomination_summary(cube, selected_month, cols, labels)
+                st.dataframe(
+                    summary.style.format({'月間入金枚数': '{:,}', '平均枚数': '{:.1f}'}),
+                    hide_index=True
+                )
                 
-                for col in cols:
-                    pivot_data = df_filtered.pivot_table(
-                        values=col,
-                        index='hour',
-                        columns='date_str',
-                        aggfunc='mean'
-                    ).round(1)
-                    
-                    fig, ax = plt.subplots(figsize=(15, 8))
-                    sns.heatmap(pivot_data, cmap='YlOrRd', annot=True, fmt='.1f',
-                              cbar_kws={'label': '平均枚数'})
-                    plt.title(f'{labels[col]}の時間帯別平均取扱枚数')
-                    plt.xlabel('日付')
-                    plt.ylabel('時間帯')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
-                    
-                    # ヒートマップのデータソース説明を追加
-                    st.markdown(f"""
-                    **データソース情報**:
-                    - ファイル名: {selected_branch}_ATM精算POSレジ自動釣銭機確定データ.csv
-                    - 対象列: ATM現金（手入力以外）入金（各金種）枚数, 時刻
-                    - 集計期間: {selected_month.strftime('%Y年%m月')}
-                    - 集計方法: 時間帯（0-23時）・日付別の平均入金枚数
-                    """)
+                selected_label = st.selectbox('表示する金種を選択してください', [labels[col] for col in cols])
+                selected_col = next(col for col in cols if labels[col] == selected_label)
+                
+                show_chart(
+                    ('金種別分析', 'heatmap', selected_branch, str(selected_month), (selected_col,), cube.version),
+                    lambda: hourly_heatmap_chart(hourly_heatmap(cube, selected_month, selected_col),
+                                                 labels[selected_col])
+                )
+                
+                # ヒートマップのデータソース説明を追加
+                st.markdown(f"""
+                **データソース情報**:
+                - ファイル名: {selected_branch}_ATM精算POSレジ自動釣銭機確定データ.csv
+                - 対象列: ATM現金（手入力以外）入金（各金種）枚数, 時刻
+                - 集計期間: {selected_month.strftime('%Y年%m月')}
+                - 集計方法: 時間帯（0-23時）・日付別の平均入金枚数
+                """)
         
         except Exception as e:
             st.error(f"データの表示中にエラーが発生しました: {str(e)}")
-            print(f"エラーの詳細: {str(e)}")
+            logger.exception("エラーの詳細: %s", e)
             if not self.branch_data:
                 st.warning("データが読み込まれていません。デモデータを使用します。")
                 self.create_demo_data()
@@ -525,7 +423,7 @@ class ATMDashboard:
             
             # 月選択
             first_branch_data = next(iter(self.branch_data.values()))
-            available_months = first_branch_data['atm_df']['日付'].dt.to_period('M').unique()
+            available_months = atm_months(first_branch_data)
             
             if len(available_months) == 0:
                 st.error("利用可能な月別データがありません。")
@@ -537,42 +435,23 @@ class ATMDashboard:
                 format_func=lambda x: f"{x.year}年{x.month}月"
             )
             
+            # 支店ごとの取引件数と平均在高金額（百万円単位）
+            comparison = comparison_table(self.branch_data, selected_month)
+            if comparison.empty:
+                st.warning("選択された月のデータがありません。")
+                return
+            versions = tuple(data['cube'].version for data in self.branch_data.values())
+            
             # 2列のレイアウトを作成
             col1, col2 = st.columns(2)
             
             with col1:
                 # 取引件数の比較
                 st.subheader('取引件数の比較')
-                transaction_counts = {}
-                for code, data in self.branch_data.items():
-                    df_filtered = data['atm_df'][data['atm_df']['日付'].dt.to_period('M') == selected_month]
-                    transaction_counts[code] = len(df_filtered)
-                
-                if not transaction_counts:
-                    st.warning("選択された月のデータがありません。")
-                    return
-                
-                # 取引件数の最大値と最小値を取得して色の濃淡を計算
-                max_count = max(transaction_counts.values())
-                min_count = min(transaction_counts.values())
-                if max_count != min_count:
-                    colors = [(count - min_count) / (max_count - min_count) for count in transaction_counts.values()]
-                else:
-                    colors = [0.5] * len(transaction_counts)
-                
-                fig, ax = plt.subplots(figsize=(6, 4))
-                bars = ax.bar(transaction_counts.keys(), transaction_counts.values())
-                
-                # 各バーに色を設定
-                for bar, color in zip(bars, colors):
-                    bar.set_color(plt.cm.Blues(0.3 + color * 0.5))  # 青の濃淡
-                
-                ax.set_xlabel('支店コード')
-                ax.set_ylabel('取引件数')
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-                st.pyplot(fig)
-                plt.close()
+                show_chart(
+                    ('支店間比較', 'transactions', None, str(selected_month), (), versions),
+                    lambda: transactions_chart(comparison['取引件数'])
+                )
                 
                 # データソースの説明を追加
                 st.markdown(f"""
@@ -586,41 +465,10 @@ class ATMDashboard:
             with col2:
                 # 平均在高金額の比較
                 st.subheader('平均在高金額の比較')
-                avg_balances = {}
-                for code, data in self.branch_data.items():
-                    df_filtered = data['atm_df'][data['atm_df']['日付'].dt.to_period('M') == selected_month]
-                    # 百万円単位に変換
-                    avg_balances[code] = df_filtered['在高合計金額'].mean() / 1_000_000
-                
-                if not avg_balances:
-                    st.warning("選択された月のデータがありません。")
-                    return
-                
-                # 平均在高金額の最大値と最小値を取得して色の濃淡を計算
-                max_balance = max(avg_balances.values())
-                min_balance = min(avg_balances.values())
-                if max_balance != min_balance:
-                    colors = [(balance - min_balance) / (max_balance - min_balance) for balance in avg_balances.values()]
-                else:
-                    colors = [0.5] * len(avg_balances)
-                
-                fig, ax = plt.subplots(figsize=(6, 4))
-                bars = ax.bar(avg_balances.keys(), avg_balances.values())
-                
-                # 各バーに色を設定
-                for bar, color in zip(bars, colors):
-                    bar.set_color(plt.cm.Greens(0.3 + color * 0.5))  # 緑の濃淡
-                
-                ax.set_xlabel('支店コード')
-                ax.set_ylabel('平均在高金額（百万円）')
-                
-                # Y軸のフォーマットを設定（カンマ区切りの整数表示）
-                ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{int(x):,}'))
-                
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-                st.pyplot(fig)
-                plt.close()
+                show_chart(
+                    ('支店間比較', 'balances', None, str(selected_month), (), versions),
+                    lambda: balances_chart(comparison['平均在高金額（百万円）'])
+                )
                 
                 # データソースの説明を追加
                 st.markdown(f"""
@@ -630,331 +478,50 @@ class ATMDashboard:
                 - 集計期間: {selected_month.strftime('%Y年%m月')}
                 - 集計方法: 支店ごとの平均在高金額（百万円単位）
                 """)
+            
+            # 現金フローの比較（日次フローのビューから月の合計を集計）
+            flows = daily_flow_table(self.cash_flow_data)
+            with span('filter', page='支店間比較', month=selected_month):
+                flow_totals = flow_comparison(flows, selected_month)
+            if not flow_totals.empty:
+                st.subheader('現金フロー（⑤合計）の比較')
+                st.dataframe(flow_totals.style.format('{:,.0f}'))
+                
+                st.markdown(f"""
+                **データソース情報**:
+                - ファイル名: 各支店の現金フローデータ（元金補充・銀行預入・銀行両替・ATM精算）
+                - 集計期間: {selected_month.strftime('%Y年%m月')}
+                - 集計方法: 支店・金種ごとの⑤合計（①補充－②預入＋③両替－④精算）の月合計枚数
+                """)
         
         except Exception as e:
             st.error(f"データの表示中にエラーが発生しました: {str(e)}")
-            print(f"エラーの詳細: {str(e)}")
+            logger.exception("エラーの詳細: %s", e)
             if not self.branch_data:
                 st.warning("データが読み込まれていません。デモデータを使用します。")
                 self.create_demo_data()
 
-    def create_denomination_analysis(self, selected_branch, selected_month):
-        """金種別分析を作成"""
-        # データのフィルタリング
-        df = self.branch_data[selected_branch]['atm_df']
-        if selected_month != 'すべて':
-            month_date = datetime.strptime(selected_month, '%Y年%m月')
-            df = df[(df['日付'].dt.year == month_date.year) & 
-                   (df['日付'].dt.month == month_date.month)]
-
-        # 紙幣と硬貨の種別
-        bill_types = ['10000', '5000', '2000', '1000']
-        coin_types = ['500', '100', '50', '10', '5', '1']
-
-        st.subheader('金種別分析')
-        
-        # 支店選択
-        st.write('支店を選択してください')
-        branch = st.selectbox('', list(self.branch_data.keys()), key='branch_selector')
-        
-        # 月選択
-        st.write('月を選択してください')
-        month_options = ['すべて'] + sorted(self.branch_data[branch]['atm_df']['日付'].dt.strftime('%Y年%m月').unique().tolist())
-        month = st.selectbox('', month_options, key='month_selector')
-        
-        # 金種タイプの選択（紙幣/硬貨）
-        st.write('金種タイプ')
-        denomination_type = st.radio('', ['紙幣', '硬貨'])
-
-        if denomination_type == '紙幣':
-            # 紙幣の推移グラフ
-            st.subheader('紙幣種別の推移')
-            fig, ax = plt.subplots(figsize=(15, 6))
-            
-            for bill in bill_types:
-                col = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                if col in df.columns:
-                    # 日付と曜日を結合
-                    df['date_str'] = df['日付'].dt.strftime('%Y-%m-%d') + '(' + df['曜日'] + ')'
-                    daily_avg = df.groupby('date_str')[col].mean()
-                    ax.plot(daily_avg.index, daily_avg.values, marker='o', label=f'{bill}円札')
-            
-            plt.title(f'紙幣種別の日次推移 - {selected_branch}')
-            plt.xlabel('日付')
-            plt.ylabel('平均枚数')
-            plt.grid(True)
-            plt.legend()
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig)
-            
-            # 紙幣の時間帯別ヒートマップ
-            st.subheader('紙幣種別の時間帯別平均取扱枚数')
-            for bill in bill_types:
-                col = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                if col in df.columns:
-                    # 時刻を時間に変換
-                    df['時間'] = pd.to_datetime(df['時刻'].astype(str)).dt.hour
-                    pivot_data = df.pivot_table(
-                        values=col,
-                        index='時間',
-                        columns='date_str',
-                        aggfunc='mean'
-                    ).round(1)
-                    
-                    fig, ax = plt.subplots(figsize=(15, 8))
-                    sns.heatmap(pivot_data, cmap='YlOrRd', annot=True, fmt='.1f', 
-                              cbar_kws={'label': '平均枚数'})
-                    plt.title(f'{bill}円札の時間帯別平均取扱枚数')
-                    plt.xlabel('日付')
-                    plt.ylabel('時間帯')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-        
-        else:
-            # 硬貨の推移グラフ
-            st.subheader('硬貨種別の推移')
-            fig, ax = plt.subplots(figsize=(15, 6))
-            
-            for coin in coin_types:
-                col = f'ATM現金（手入力以外）入金（{coin}円）枚数'
-                if col in df.columns:
-                    # 日付と曜日を結合
-                    df['date_str'] = df['日付'].dt.strftime('%Y-%m-%d') + '(' + df['曜日'].str[0] + ')'
-                    daily_avg = df.groupby('date_str')[col].mean()
-                    ax.plot(daily_avg.index, daily_avg.values, marker='o', label=f'{coin}円玉')
-            
-            plt.title(f'硬貨種別の日次推移 - {selected_branch}')
-            plt.xlabel('日付')
-            plt.ylabel('平均枚数')
-            plt.grid(True)
-            plt.legend()
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig)
-
-            # 硬貨の推移グラフのデータソース説明
-            st.markdown("""
-            **データソース情報**:
-            - ファイル名: {selected_branch}_ATM精算POSレジ自動釣銭機確定データ.csv
-            - 対象列: ATM現金（手入力以外）入金（各金種）枚数
-            - 集計期間: {selected_month.strftime('%Y年%m月')}
-            - 集計方法: 日別・金種別の平均入金枚数
-            """)
-            
-            # 硬貨の時間帯別ヒートマップ
-            st.subheader('硬貨種別の時間帯別平均取扱枚数')
-            for coin in coin_types:
-                col = f'ATM現金（手入力以外）入金（{coin}円）枚数'
-                if col in df.columns:
-                    # 時刻を時間に変換
-                    df['時間'] = pd.to_datetime(df['時刻'].astype(str)).dt.hour
-
     def create_demo_data(self):
         """デモデータの作成"""
-        print("デモデータを作成中...")
+        logger.debug("デモデータを作成中...")
         
         # サンプルの支店コード
         branch_codes = ['00643', '00669', '00748', '00796']
         
         for code in branch_codes:
-            # デモデータの作成
-            dates = pd.date_range(start='2023-11-01', end='2024-01-31')
-            n_rows = len(dates)
+            # 実データと同じ形式の合成データ（再実行をまたいで同じデータを使う）
+            self.branch_data[code] = demo_branch(code)[0]
             
-            # 基本データの作成
-            df = pd.DataFrame({
-                '日付': dates,
-                '時刻': [pd.to_datetime(f"{np.random.randint(8, 22):02d}:00:00").time() for _ in range(n_rows)],
-                '在高合計金額': np.random.randint(1000000, 10000000, n_rows),
-                'ATM現金入金計金額': np.random.randint(0, 1000000, n_rows)
-            })
-            
-            # 曜日の追加
-            df['曜日'] = df['日付'].dt.day_name().map(WEEKDAY_MAP)
-            
-            # 金種データの追加（より現実的な分布に）
-            for bill in self.bills.keys():
-                col_name = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                if bill == '10000':
-                    df[col_name] = np.random.poisson(30, n_rows)  # 10000円札は比較的多い
-                elif bill == '5000':
-                    df[col_name] = np.random.poisson(20, n_rows)
-                else:
-                    df[col_name] = np.random.poisson(10, n_rows)
-            
-            for coin in self.coins.keys():
-                col_name = f'ATM現金（手入力以外）入金（{coin}円）枚数'
-                if coin in ['100', '500']:
-                    df[col_name] = np.random.poisson(100, n_rows)  # 100円玉と500円玉は多い
-                elif coin in ['50', '10']:
-                    df[col_name] = np.random.poisson(50, n_rows)
-                else:
-                    df[col_name] = np.random.poisson(20, n_rows)
-            
-            # 金種の列を特定
-            bill_cols = [f'ATM現金（手入力以外）入金（{bill}円）枚数' for bill in self.bills.keys()]
-            coin_cols = [f'ATM現金（手入力以外）入金（{coin}円）枚数' for coin in self.coins.keys()]
-            
-            self.branch_data[code] = {
-                'atm_df': df,
-                'bill_cols': bill_cols,
-                'coin_cols': coin_cols
-            }
-            
-            print(f"支店{code}のデモデータを作成しました")
+            logger.debug("支店%sのデモデータを作成しました", code)
 
     def create_demo_cash_flow_data(self):
-        """実データを基にしたデモデータの作成"""
-        print("実データを基にデモデータを作成中...")
+        """デモデータ（合成データ）の現金フローデータの作成"""
+        logger.debug("デモデータを作成中...")
         
-        # 実データが存在する支店のデータを使用
         for code in self.branch_codes:
-            if code in self.branch_data:
-                original_data = self.branch_data[code]['atm_df']
-                
-                # 現金フローデータの作成
-                data_frames = {}
-                
-                # 基本となるデータフレームの作成
-                base_df = original_data.copy()
-                base_df['日付'] = pd.to_datetime(base_df['日付'])
-                
-                # POSレジ出金データ
-                pos_withdrawal_df = base_df.copy()
-                for bill in self.bills.keys():
-                    col_name = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                    if col_name in pos_withdrawal_df.columns:
-                        new_col = f'出金枚数_{bill}円'
-                        # 実データの分布を保持しながら、新しい乱数を生成
-                        mean_value = pos_withdrawal_df[col_name].mean()
-                        std_value = pos_withdrawal_df[col_name].std()
-                        pos_withdrawal_df[new_col] = np.random.normal(mean_value, std_value, len(pos_withdrawal_df)).round()
-                data_frames['pos_withdrawal'] = pos_withdrawal_df
-                
-                # 銀行預入データ
-                bank_deposit_df = base_df.copy()
-                for bill in self.bills.keys():
-                    col_name = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                    if col_name in bank_deposit_df.columns:
-                        new_col = f'預入枚数_{bill}円'
-                        mean_value = bank_deposit_df[col_name].mean()
-                        std_value = bank_deposit_df[col_name].std()
-                        bank_deposit_df[new_col] = np.random.normal(mean_value, std_value, len(bank_deposit_df)).round()
-                data_frames['bank_deposit'] = bank_deposit_df
-                
-                # 銀行両替データ
-                bank_exchange_df = base_df.copy()
-                for bill in self.bills.keys():
-                    col_name = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                    if col_name in bank_exchange_df.columns:
-                        new_col = f'両替枚数_{bill}円'
-                        mean_value = bank_exchange_df[col_name].mean()
-                        std_value = bank_exchange_df[col_name].std()
-                        bank_exchange_df[new_col] = np.random.normal(mean_value, std_value, len(bank_exchange_df)).round()
-                data_frames['bank_exchange'] = bank_exchange_df
-                
-                # ATM精算データ
-                atm_settlement_df = base_df.copy()
-                for bill in self.bills.keys():
-                    col_name = f'ATM現金（手入力以外）入金（{bill}円）枚数'
-                    if col_name in atm_settlement_df.columns:
-                        new_col = f'精算枚数_{bill}円'
-                        mean_value = atm_settlement_df[col_name].mean()
-                        std_value = atm_settlement_df[col_name].std()
-                        atm_settlement_df[new_col] = np.random.normal(mean_value, std_value, len(atm_settlement_df)).round()
-                data_frames['atm_settlement'] = atm_settlement_df
-                
-                # 硬貨データの追加
-                for df_type, df in data_frames.items():
-                    for coin in self.coins.keys():
-                        col_name = f'ATM現金（手入力以外）入金（{coin}円）枚数'
-                        if col_name in base_df.columns:
-                            if df_type == 'pos_withdrawal':
-                                new_col = f'出金枚数_{coin}円'
-                            elif df_type == 'bank_deposit':
-                                new_col = f'預入枚数_{coin}円'
-                            elif df_type == 'bank_exchange':
-                                new_col = f'両替枚数_{coin}円'
-                            else:  # atm_settlement
-                                new_col = f'精算枚数_{coin}円'
-                            
-                            mean_value = base_df[col_name].mean()
-                            std_value = base_df[col_name].std()
-                            df[new_col] = np.random.normal(mean_value, std_value, len(df)).round()
-                
-                self.cash_flow_data[code] = data_frames
-                print(f"支店{code}の実データを基にしたデモデータを作成しました")
-            else:
-                print(f"支店{code}の実データが見つかりません")
-        
-        if not self.cash_flow_data:
-            print("実データが見つからないため、ダミーデータを作成します")
-            self.create_dummy_cash_flow_data()
-
-    def create_dummy_cash_flow_data(self):
-        """完全なダミーデータの作成（実データが全く存在しない場合のフォールバック）"""
-        print("ダミーデータを作成中...")
-        
-        for code in self.branch_codes:
-            # 日付範囲の設定
-            dates = pd.date_range(start='2023-11-01', end='2024-01-31')
-            n_rows = len(dates)
-            
-            # 基本データフレームの作成
-            base_df = pd.DataFrame({
-                '日付': dates,
-                '時刻': [pd.to_datetime(f"{np.random.randint(8, 22):02d}:00:00").time() for _ in range(n_rows)],
-                '在高合計金額': np.random.randint(1000000, 10000000, n_rows),
-                'ATM現金入金計金額': np.random.randint(0, 1000000, n_rows)
-            })
-            
-            # 曜日の追加
-            base_df['曜日'] = base_df['日付'].dt.day_name().map(WEEKDAY_MAP)
-            
-            data_frames = {}
-            for data_type in ['pos_withdrawal', 'bank_deposit', 'bank_exchange', 'atm_settlement']:
-                df = base_df.copy()
-                
-                # 金種データの追加
-                for bill in self.bills.keys():
-                    if data_type == 'pos_withdrawal':
-                        col_name = f'出金枚数_{bill}円'
-                    elif data_type == 'bank_deposit':
-                        col_name = f'預入枚数_{bill}円'
-                    elif data_type == 'bank_exchange':
-                        col_name = f'両替枚数_{bill}円'
-                    else:
-                        col_name = f'精算枚数_{bill}円'
-                    
-                    if bill == '10000':
-                        df[col_name] = np.random.poisson(30, n_rows)
-                    elif bill == '5000':
-                        df[col_name] = np.random.poisson(20, n_rows)
-                    else:
-                        df[col_name] = np.random.poisson(10, n_rows)
-                
-                for coin in self.coins.keys():
-                    if data_type == 'pos_withdrawal':
-                        col_name = f'出金枚数_{coin}円'
-                    elif data_type == 'bank_deposit':
-                        col_name = f'預入枚数_{coin}円'
-                    elif data_type == 'bank_exchange':
-                        col_name = f'両替枚数_{coin}円'
-                    else:
-                        col_name = f'精算枚数_{coin}円'
-                    
-                    if coin in ['100', '500']:
-                        df[col_name] = np.random.poisson(100, n_rows)
-                    elif coin in ['50', '10']:
-                        df[col_name] = np.random.poisson(50, n_rows)
-                    else:
-                        df[col_name] = np.random.poisson(20, n_rows)
-                
-                data_frames[data_type] = df
-            
-            self.cash_flow_data[code] = data_frames
-            print(f"支店{code}のダミーデータを作成しました")
+            # ATM精算データのデモデータと同じ合成データ（再実行をまたいで同じデータを使う）
+            self.cash_flow_data[code] = demo_branch(code)[1]
+            logger.debug("支店%sのデモデータを作成しました", code)
 
     def show_cash_flow(self):
         """現金フロー分析ページの表示"""
@@ -967,42 +534,20 @@ class ATMDashboard:
                 self.branch_codes
             )
             
+            # 全支店・全金種の日次フローと予測値（データが変わらない限り再計算しない）
+            flows = daily_flow_table(self.cash_flow_data)
+            forecasts = forecast_table(flows)
+
             # 期間選択用の月リストを作成
-            date_range = pd.date_range(start='2023-11-01', end='2024-01-31', freq='MS')
-            available_months = [d.strftime('%Y年%m月') for d in date_range]
+            months = flow_months(flows, selected_branch) or list(pd.period_range('2023-11', '2024-01', freq='M'))
+            available_months = [month.strftime('%Y年%m月') for month in months]
             selected_month = st.selectbox(
                 '月を選択してください',
                 available_months
             )
-            
-            # 選択された月の開始日と終了日を設定
-            selected_date = datetime.strptime(selected_month, '%Y年%m月')
-            start_date = selected_date.replace(day=1)
-            end_date = (selected_date.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            period = months[available_months.index(selected_month)]
             
             if selected_branch in self.cash_flow_data:
-                data = self.cash_flow_data[selected_branch]
-                
-                # 日付でフィルタリング
-                filtered_data = {}
-                for key in data:
-                    df = data[key].copy()  # データのコピーを作成
-                    df['日付'] = pd.to_datetime(df['日付'])  # 日付を確実にdatetime型に変換
-                    # 曜日の設定を追加
-                    df['曜日'] = df['日付'].dt.day_name().map({
-                        'Monday': '月',
-                        'Tuesday': '火',
-                        'Wednesday': '水',
-                        'Thursday': '木',
-                        'Friday': '金',
-                        'Saturday': '土',
-                        'Sunday': '日'
-                    })
-                    filtered_data[key] = df[
-                        (df['日付'] >= start_date) & 
-                        (df['日付'] <= end_date)
-                    ]
-                
                 # 現金フローの計算
                 st.subheader('現金フロー計算')
                 
@@ -1013,155 +558,149 @@ class ATMDashboard:
                     denominations = self.bills
                 else:
                     denominations = self.coins
-                
-                # 各金種ごとの計算
-                for value, label in denominations.items():
-                    st.write(f'### {label}の流れ')
-                    
-                    # 日次の現金フロー計算
-                    date_range = pd.date_range(start_date, end_date)
-                    flow_df = pd.DataFrame(index=date_range)
-                    flow_df.index.name = '日付'
-                    
-                    # ①元金補充POSレジ出金
-                    if 'pos_withdrawal' in filtered_data:
-                        pos_withdrawal_col = f'出金枚数_{value}円'
-                        if pos_withdrawal_col in filtered_data['pos_withdrawal'].columns:
-                            daily_withdrawal = filtered_data['pos_withdrawal'].groupby('日付')[pos_withdrawal_col].sum()
-                            flow_df['①補充'] = daily_withdrawal
-                    
-                    # ②銀行預入出金
-                    if 'bank_deposit' in filtered_data:
-                        bank_deposit_col = f'預入枚数_{value}円'
-                        if bank_deposit_col in filtered_data['bank_deposit'].columns:
-                            daily_deposit = filtered_data['bank_deposit'].groupby('日付')[bank_deposit_col].sum()
-                            flow_df['②預入'] = daily_deposit
-                    
-                    # ③銀行両替金入金
-                    if 'bank_exchange' in filtered_data:
-                        bank_exchange_col = f'両替枚数_{value}円'
-                        if bank_exchange_col in filtered_data['bank_exchange'].columns:
-                            daily_exchange = filtered_data['bank_exchange'].groupby('日付')[bank_exchange_col].sum()
-                            flow_df['③両替'] = daily_exchange
-                    
-                    # ④ATM精算POSレジ
-                    if 'atm_settlement' in filtered_data:
-                        atm_settlement_col = f'精算枚数_{value}円'
-                        if atm_settlement_col in filtered_data['atm_settlement'].columns:
-                            daily_settlement = filtered_data['atm_settlement'].groupby('日付')[atm_settlement_col].sum()
-                            flow_df['④精算'] = daily_settlement
-                    
-                    # 欠損値を0で埋める
-                    flow_df = flow_df.fillna(0)
-                    
-                    # ⑤合計（①-②+③-④）
-                    flow_df['⑤合計'] = flow_df['①補充'] - flow_df['②預入'] + flow_df['③両替'] - flow_df['④精算']
-                    
-                    # 予測値の計算
-                    flow_df['曜日'] = flow_df.index.day_name().map(WEEKDAY_MAP)
-                    flow_df['日'] = flow_df.index.day
-                    flow_df['7の日'] = flow_df['日'].apply(lambda x: '7の日' if str(x).endswith('7') else '通常日')
-                    flow_df['予測値'] = 0.0  # 予測値の初期化
-                    
-                    # 7の日とそれ以外で分けて予測値を計算
-                    for idx in flow_df.index:
-                        current_day = flow_df.loc[idx]
-                        if current_day['7の日'] == '7の日':
-                            # 7の日の場合、他の7の日の平均を使用
-                            seven_days_mean = flow_df[
-                                (flow_df['7の日'] == '7の日') & 
-                                (flow_df.index < idx)
-                            ]['⑤合計'].mean()
-                            flow_df.loc[idx, '予測値'] = seven_days_mean if not pd.isna(seven_days_mean) else current_day['⑤合計']
+
+                # 予測方法の選択
+                method = st.radio('予測方法', [METHOD_SAME_CLASS, METHOD_MODEL], horizontal=True)
+
+                with span('filter', page='現金フロー分析', branch=selected_branch, month=selected_month):
+                    month_flows, month_forecasts = month_cash_flows(flows, forecasts, selected_branch, period,
+                                                                    [method])
+                profile = hourly_profile({selected_branch: self.branch_data[selected_branch]}) \
+                    if selected_branch in self.branch_data else None
+
+                # 予測精度の検証（全期間・全支店を対象に一度だけ計算し、結果は再利用）
+                with st.expander('予測精度の検証（バックテスト）'):
+                    st.markdown(f"""
+                    過去の各時点（{BACKTEST_STEP}日ごと）を起点に、その時点より前のデータだけで
+                    {'・'.join(f'{h}日先' for h in BACKTEST_HORIZONS)}の⑤合計を予測し、実績値と比較します。
+                    """)
+                    if st.button('バックテストを実行'):
+                        st.session_state.backtest_requested = True
+                    if st.session_state.get('backtest_requested'):
+                        with st.spinner('バックテストを実行中...'):
+                            results = backtest(flows)
+                        results = results[(results['branch'] == selected_branch) & (results['series'] == FLOW_TOTAL)]
+                        if results.empty:
+                            st.info('バックテストに必要な期間のデータがありません。')
                         else:
-                            # 通常日の場合、同じ曜日の平均を使用
-                            weekday_mean = flow_df[
-                                (flow_df['曜日'] == current_day['曜日']) & 
-                                (flow_df['7の日'] == '通常日') & 
-                                (flow_df.index < idx)
-                            ]['⑤合計'].mean()
-                            flow_df.loc[idx, '予測値'] = weekday_mean if not pd.isna(weekday_mean) else current_day['⑤合計']
-                    
-                    # グラフの描画
-                    fig, ax = plt.subplots(figsize=(15, 6))
-                    for col in ['①補充', '②預入', '③両替', '④精算', '⑤合計']:
-                        ax.plot(flow_df.index.strftime('%m/%d(%a)'), flow_df[col], label=col, marker='o')
-                    
-                    ax.set_xlabel('日付')
-                    ax.set_ylabel('枚数')
-                    ax.set_title(f'{label}の現金フロー')
-                    ax.legend()
-                    plt.grid(True)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
-                    
-                    # 予測グラフの描画
-                    fig, ax = plt.subplots(figsize=(15, 6))
-                    ax.plot(flow_df.index.strftime('%m/%d(%a)'), flow_df['⑤合計'], label='実績値', marker='o')
-                    ax.plot(flow_df.index.strftime('%m/%d(%a)'), flow_df['予測値'], label='予測値（曜日・7の日ベース）', linestyle='--')
-                    ax.set_xlabel('日付')
-                    ax.set_ylabel('枚数')
-                    ax.set_title(f'{label}の釣銭予測')
-                    ax.legend()
-                    plt.grid(True)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
-                    
-                    # 予測グラフのデータソース情報を追加
+                            st.write('#### 予測方法別の精度')
+                            st.dataframe(backtest_summary(results).round(2), hide_index=True)
+                            st.write('#### 金種別の精度')
+                            st.dataframe(
+                                backtest_summary(results, ['denomination', 'method', 'horizon']).round(2),
+                                hide_index=True
+                            )
+                
+                # 金種ごとの概要（月間の実績合計・予測合計・誤差）
+                st.write('### 金種別の概要')
+                summary = cash_flow_summary(month_flows, month_forecasts[method], list(denominations))
+                st.dataframe(summary.style.format('{:,.1f}', subset=['実績合計', '予測合計', '平均絶対誤差']),
+                             hide_index=True)
+                
+                # 選択した金種だけを計算・描画
+                label = st.selectbox('表示する金種を選択してください', list(denominations.values()))
+                value = next(value for value, name in denominations.items() if name == label)
+                st.write(f'### {label}の流れ')
+                
+                # 日次の現金フロー（取引のない日は0）と予測値（予測表から取得）
+                flow_df = denomination_flow_frame(month_flows, month_forecasts, value, period)
+                flow_df['予測値'] = flow_df[forecast_column(method)]
+                
+                # 現金フローと予測のグラフ（日次フロー表だけから決まり、未描画なら並列に描画）
+                show_charts([
+                    (
+                        ('現金フロー分析', 'flows', selected_branch, selected_month, (value,), DAILY_FLOW_VIEW.version),
+                        lambda: flows_chart(flow_df, f'{label}の現金フロー')
+                    ),
+                    (
+                        ('現金フロー分析', 'forecast', selected_branch, selected_month, (value, method),
+                         DAILY_FLOW_VIEW.version),
+                        lambda: forecast_chart(flow_df, [method], f'{label}の釣銭予測')
+                    )
+                ])
+                
+                # 予測グラフのデータソース情報を追加
+                st.markdown(f"""
+                **予測データソース情報**:
+                - 入力データ: 上記の現金フロー合計値（⑤合計）
+                - 予測期間: {selected_month}
+                - 予測方法: {method}
+                - 更新頻度: 日次
+                """)
+                if method == METHOD_SAME_CLASS:
+                    st.markdown("""
+                    - 7のつく日（7,17,27日）: 過去の7のつく日の平均値
+                    - その他の日: 同じ曜日の過去平均値
+                    - 平均には選択した月より前も含め、その日より前の全期間のデータを使用
+                    """)
+                else:
                     st.markdown(f"""
-                    **予測データソース情報**:
-                    - 入力データ: 上記の現金フロー合計値（⑤合計）
-                    - 予測期間: {selected_month}
-                    - 予測方法: 
-                      - 7のつく日（7,17,27日）: 過去の7のつく日の平均値
-                      - その他の日: 同じ曜日の過去平均値
-                    - 更新頻度: 日次
+                    - 基本予測値: 直近{MOVING_AVERAGE_DAYS}日間の移動平均
+                    - トレンド・曜日の変動・特異日補正（{'・'.join(SPECIAL_DAY_NAMES.values())}）・季節調整を加算
+                    - 各日の予測にはその日より前の全期間のデータを使用
                     """)
 
-                    # 予測結果の詳細表示
-                    st.write('### 予測結果詳細')
-                    
-                    # データフレームの作成
-                    prediction_detail = pd.DataFrame({
-                        '①実績値': flow_df['⑤合計'].round(1),
-                        '②予測値': flow_df['予測値'].round(1),
-                        '③差分(①-②)': (flow_df['⑤合計'] - flow_df['予測値']).round(1)
-                    })
-                    
-                    # インデックスを日付（曜日）形式に変更
-                    prediction_detail.index = flow_df.index.strftime('%m/%d(%a)')
-                    
-                    # 表の表示（幅を調整）
-                    st.dataframe(
-                        prediction_detail.style.format({
-                            '①実績値': '{:.1f}',
-                            '②予測値': '{:.1f}',
-                            '③差分(①-②)': '{:.1f}'
-                        }).set_properties(**{
-                            'text-align': 'right',
-                            'width': '150px'
-                        }),
-                        width=800
-                    )
-                    
-                    # 基本統計量の表示
-                    st.write('### 基本統計量')
-                    stats_df = prediction_detail.describe().round(1)
-                    st.dataframe(
-                        stats_df.style.format('{:.1f}'),
-                        width=800
-                    )
-            
+                # 時間帯別の需要配分（ATM入金枚数の構成比）
+                if profile is not None:
+                    shares = profile[profile['denomination'] == value]
+                    if not shares.empty:
+                        with st.expander('時間帯別の需要配分'):
+                            st.bar_chart(shares.set_index('hour')['構成比'])
+
+                # 予測結果の詳細表示
+                st.write('### 予測結果詳細')
+                
+                # データフレームの作成
+                prediction_detail = pd.DataFrame({
+                    '①実績値': flow_df['⑤合計'].round(1),
+                    '②予測値': flow_df['予測値'].round(1),
+                    '③差分(①-②)': (flow_df['⑤合計'] - flow_df['予測値']).round(1)
+                })
+                
+                # インデックスを日付（曜日）形式に変更
+                prediction_detail.index = day_labels(flow_df)
+                
+                # 表の表示（幅を調整）
+                st.dataframe(
+                    prediction_detail.style.format({
+                        '①実績値': '{:.1f}',
+                        '②予測値': '{:.1f}',
+                        '③差分(①-②)': '{:.1f}'
+                    }).set_properties(**{
+                        'text-align': 'right',
+                        'width': '150px'
+                    }),
+                    width=800
+                )
+                
+                # 基本統計量の表示
+                st.write('### 基本統計量')
+                stats_df = prediction_detail.describe().round(1)
+                st.dataframe(
+                    stats_df.style.format('{:.1f}'),
+                    width=800
+                )
+
             else:
                 st.warning(f"支店{selected_branch}のデータが見つかりません。")
         
         except Exception as e:
             st.error(f"現金フロー分析中にエラーが発生しました: {str(e)}")
-            print(f"エラーの詳細: {str(e)}")
+            logger.exception("エラーの詳細: %s", e)
+
+    def show_memory_report(self):
+        """サイドバーに支店ごとのメモリ使用量を表示"""
+        report = memory_report(self.branch_data, self.cash_flow_data)
+        with st.sidebar.expander(f"メモリ使用量（合計 {report['合計(MB)'].sum():.1f} MB）"):
+            st.dataframe(
+                report.style.format({
+                    '行数': '{:,}',
+                    'ATM精算(MB)': '{:.2f}',
+                    '現金フロー(MB)': '{:.2f}',
+                    '合計(MB)': '{:.2f}'
+                }),
+                hide_index=True
+            )
 
     def run(self):
         """ダッシュボードを実行"""
@@ -1174,32 +713,62 @@ class ATMDashboard:
                 st.error("利用可能な支店データがありません。")
                 return
             
-            print(f"利用可能な支店: {available_branches}")
+            logger.debug("利用可能な支店: %s", available_branches)
+
+            self.show_memory_report()
             
-            if self.page == '概要':
-                print("概要ページを表示します")
-                self.show_overview()
-            elif self.page == '金種別分析':
-                print("金種別分析ページを表示します")
-                self.show_money_analysis()
-            elif self.page == '支店間比較':
-                print("支店間比較ページを表示します")
-                self.show_comparison()
-            elif self.page == '現金フロー分析':
-                print("現金フロー分析ページを表示します")
-                self.show_cash_flow()
-            else:
-                print(f"不明なページが選択されました: {self.page}")
-                st.error("無効なページが選択されました。")
+            with span('page', page=self.page):
+                self.show_page()
+            
+            if st.session_state.get('show_profiler'):
+                self.show_profiler()
                 
         except Exception as e:
-            print(f"実行時エラー: {str(e)}")
+            logger.exception("実行時エラー: %s", e)
             st.error(f"エラーが発生しました: {str(e)}")
             raise e
 
+    def show_page(self):
+        """選択されたページを表示"""
+        if self.page == '概要':
+            logger.debug("概要ページを表示します")
+            self.show_overview()
+        elif self.page == '金種別分析':
+            logger.debug("金種別分析ページを表示します")
+            self.show_money_analysis()
+        elif self.page == '支店間比較':
+            logger.debug("支店間比較ページを表示します")
+            self.show_comparison()
+        elif self.page == '現金フロー分析':
+            logger.debug("現金フロー分析ページを表示します")
+            self.show_cash_flow()
+        else:
+            logger.warning("不明なページが選択されました: %s", self.page)
+            st.error("無効なページが選択されました。")
+
+    def show_profiler(self):
+        """サイドバーにこの再実行で計測した区間の処理時間を表示"""
+        recorder = current_recorder()
+        summary = recorder.summary() if recorder else pd.DataFrame()
+        elapsed = time.perf_counter() - SCRIPT_STARTED
+        with st.sidebar.expander(f"プロファイラ（この再実行 {elapsed:.2f}秒）", expanded=True):
+            if summary.empty:
+                st.write('計測した区間はありません。')
+                return
+            st.dataframe(
+                summary.rename(columns={'span': '区間', 'detail': '対象', 'seconds': '秒', 'count': '回数'})
+                .style.format({'秒': '{:.3f}'}),
+                hide_index=True
+            )
+            st.caption('区間は入れ子になるため、合計は再実行の時間と一致しません。プロセスプールで描画した'
+                       'グラフは「render_many」にまとめて計上されます。')
+
 def main():
     try:
-        print("アプリケーションを起動します")
+        # ログの設定と、この再実行で計測する区間の記録を開始
+        configure_logging()
+        start_recording()
+        logger.debug("アプリケーションを起動します")
         
         # ページ設定
         st.set_page_config(
@@ -1208,25 +777,20 @@ def main():
             layout='wide'
         )
         
-        # グローバルなフォント設定を更新
-        plt.rcParams['font.family'] = 'IPAexGothic'
-        plt.rcParams['font.sans-serif'] = ['IPAexGothic', 'MS Gothic', 'Hiragino Maru Gothic Pro', 'Yu Gothic']
-        plt.rcParams['axes.unicode_minus'] = False
-        
         # セッションステートの初期化
         if 'initialized' not in st.session_state:
-            print("セッションステートを初期化します")
+            logger.debug("セッションステートを初期化します")
             st.session_state.initialized = True
             st.session_state.page = '概要'
-            print("セッションステートを初期化しました")
+            logger.debug("セッションステートを初期化しました")
         
-        print("ダッシュボードを初期化します")
+        logger.debug("ダッシュボードを初期化します")
         dashboard = ATMDashboard()
-        print("ダッシュボードの実行を開始します")
+        logger.debug("ダッシュボードの実行を開始します")
         dashboard.run()
         
     except Exception as e:
-        print(f"アプリケーション起動時エラー: {str(e)}")
+        logger.exception("アプリケーション起動時エラー: %s", e)
         st.error(f"アプリケーションの起動中にエラーが発生しました: {str(e)}")
         raise e
 
@@ -0,0 +1,726 @@
+import codecs
+import contextvars
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from tracing import process_pool, span
+
+logger = logging.getLogger(__name__)
+
+# 曜日コード（月曜が0）ごとの表示名
+WEEKDAY_LABELS = ['月', '火', '水', '木', '金', '土', '日']
+
+# 給与日（特異日として扱う日）
+PAYDAY = 25
+
+# 金種（紙幣・硬貨の順）
+DENOMINATION_VALUES = ['10000', '5000', '2000', '1000', '500', '100', '50', '10', '5', '1']
+
+# 現金フローデータの種類ごとの列名の接頭辞
+CASH_FLOW_PREFIXES = {
+    'pos_withdrawal': '出金枚数',
+    'bank_deposit': '預入枚数',
+    'bank_exchange': '両替枚数',
+    'atm_settlement': '精算枚数'
+}
+
+# ファイル名の種別と現金フローデータの種類の対応
+CASH_FLOW_FILE_KINDS = {
+    'pos_withdrawal': '元金補充POSレジ出金確定データ',
+    'bank_deposit': '銀行預入出金確定データ',
+    'bank_exchange': '銀行両替金入金確定データ',
+    'atm_settlement': 'ATM精算POSレジ自動釣銭機確定データ'
+}
+
+# データファイル名の規則（{支店コード}_{種別}.csv）
+DATA_FILE_PATTERN = re.compile(r'^(\d+)_(.+)\.csv$', re.IGNORECASE)
+
+# 並列読み込みの設定（ATM_LOAD_EXECUTORはthreadまたはprocess）
+LOAD_EXECUTOR = os.environ.get('ATM_LOAD_EXECUTOR', 'thread')
+LOAD_WORKERS = int(os.environ.get('ATM_LOAD_WORKERS', '0')) or None
+
+# 解析済みデータを保存するサイドカーファイルの設定
+SIDECAR_DIR = '.atm_cache'
+# 解析処理を変更した場合は番号を上げて古いサイドカーを無効化する
+SIDECAR_VERSION = 10
+
+
+def file_fingerprint(path):
+    """ファイルのパス・サイズ・更新時刻からフィンガープリントを作成"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def sidecar_path(path, kind):
+    """元ファイルに対応するサイドカーファイルのパス"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), SIDECAR_DIR)
+    return os.path.join(directory, f"{os.path.basename(path)}.{kind}.feather")
+
+
+def _sidecar_metadata(fingerprint, state):
+    return {
+        b'source_size': str(fingerprint[1]).encode(),
+        b'source_mtime_ns': str(fingerprint[2]).encode(),
+        b'sidecar_version': str(SIDECAR_VERSION).encode(),
+        b'ingest_state': json.dumps(state).encode()
+    }
+
+
+def read_sidecar(path, kind, fingerprint):
+    """サイドカーをメモリマップで読み込む
+
+    (データフレーム, 元ファイルと一致しているか, 追記読み込みの状態)を返す。
+    元ファイルが変更されていて追記読み込みもできない場合はNoneを返す。
+    """
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+
+    cache_path = sidecar_path(path, kind)
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        table = feather.read_table(cache_path, memory_map=True)
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'sidecar_version') != str(SIDECAR_VERSION).encode():
+            return None
+
+        expected = _sidecar_metadata(fingerprint, None)
+        fresh = all(metadata.get(name) == expected[name] for name in (b'source_size', b'source_mtime_ns'))
+        state = json.loads(metadata.get(b'ingest_state', b'null'))
+        if not fresh and state is None:
+            return None
+
+        with span('read_sidecar', file=os.path.basename(path)):
+            return table.to_pandas(), fresh, state
+    except Exception as e:
+        logger.warning("サイドカー読み込みエラー: %s: %s", cache_path, e)
+        return None
+
+
+def write_sidecar(path, kind, fingerprint, df, state=None):
+    """解析済みデータフレームを列指向のサイドカーとして保存"""
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return
+
+    cache_path = sidecar_path(path, kind)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata.update(_sidecar_metadata(fingerprint, state))
+        table = table.replace_schema_metadata(metadata)
+
+        # メモリマップで読めるよう非圧縮で書き込み、完成後に置き換える
+        tmp_path = f"{cache_path}.tmp"
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning("サイドカー書き込みエラー: %s: %s", cache_path, e)
+
+
+# 文字コード判定に使う先頭バイト数
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+
+def detect_encoding(path, sample_bytes=ENCODING_SAMPLE_BYTES):
+    """ファイル先頭のバイト列から文字コードを一度だけ判定
+
+    BOM付きならutf-8-sig、utf-8として解釈できればutf-8、
+    それ以外はcp932（shift-jisの上位互換）とみなす。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(sample_bytes)
+
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+
+    # 先頭を途中で切っているため、末尾の不完全な文字は許容する
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        decoder.decode(head, final=len(head) < sample_bytes)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+
+def read_header(path, encoding):
+    """CSVのヘッダー行だけを読み込む"""
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        return next(csv.reader(io.StringIO(f.readline())), [])
+
+
+def declared_dtypes(columns):
+    """ヘッダーから列の型を宣言する（日付・時刻・枚数・金額は整数）"""
+    dtypes = {}
+    for col in columns:
+        if col in ('日付', '時刻') or '枚数' in col or '金額' in col:
+            dtypes[col] = 'int64'
+    return dtypes
+
+
+def read_branch_csv(path, encoding=None):
+    """支店CSVを文字コード判定後に一度だけ解析して読み込む
+
+    pyarrowが利用できればマルチスレッドで解析し、宣言した型で
+    読めない場合（欠損値や空白を含む列など）は型推論に切り替える。
+    """
+    encoding = encoding or detect_encoding(path)
+    dtypes = declared_dtypes(read_header(path, encoding))
+
+    try:
+        import pyarrow  # noqa: F401
+        return pd.read_csv(path, encoding=encoding, engine='pyarrow', dtype=dtypes)
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.info("宣言した型で読み込めないため型推論に切り替えます: %s: %s", path, e)
+        return pd.read_csv(path, encoding=encoding)
+
+    try:
+        return pd.read_csv(path, encoding=encoding, dtype=dtypes)
+    except (ValueError, TypeError):
+        return pd.read_csv(path, encoding=encoding)
+
+
+def ymd_to_datetime(values):
+    """YYYYMMDD形式の日付をdatetimeに変換（整数なら文字列を経由しない）"""
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_datetime(pd.DataFrame({
+            'year': values // 10000,
+            'month': values // 100 % 100,
+            'day': values % 100
+        }))
+    return pd.to_datetime(values.astype(str).str.strip(), format='%Y%m%d')
+
+
+class DataCatalog:
+    """データディレクトリを一度だけ走査して作るファイル索引
+
+    ファイル名を{支店コード}_{種別}.csvの規則で解析し、
+    支店コードと種別からファイルのパスを引けるようにする。
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.files = {}
+
+        with os.scandir(base_dir) as entries:
+            for entry in entries:
+                match = DATA_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file():
+                    code, data_type = match.groups()
+                    self.files.setdefault(code, {})[data_type] = entry.path
+
+    @property
+    def branch_codes(self):
+        """見つかった支店コード（昇順）"""
+        return sorted(self.files)
+
+    def path(self, code, data_type):
+        """支店コードと種別に対応するファイルのパス（なければNone）"""
+        return self.files.get(code, {}).get(data_type)
+
+    def settlement_path(self, code):
+        """ATM精算データのファイルのパス（種別名の昇順で最初のもの）"""
+        data_types = sorted(t for t in self.files.get(code, {}) if t.startswith('ATM精算'))
+        if not data_types:
+            return None
+        return self.files[code][data_types[0]]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def scan_data_dir(base_dir):
+    """ディレクトリの索引を取得（ファイルの追加・削除がなければ再走査しない）"""
+    mtime = os.stat(base_dir).st_mtime_ns
+    with _catalogs_lock:
+        cached = _catalogs.get(base_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    catalog = DataCatalog(base_dir)
+    with _catalogs_lock:
+        _catalogs[base_dir] = (mtime, catalog)
+    return catalog
+
+
+# 曜日の列のカテゴリ型（全データで共通のため追記分とも結合できる）
+WEEKDAY_DTYPE = pd.CategoricalDtype(WEEKDAY_LABELS, ordered=True)
+
+
+def add_calendar_features(df):
+    """日付から曜日の列を作る（曜日コードから直接カテゴリ型にする）"""
+    df['曜日'] = pd.Categorical.from_codes(df['日付'].dt.dayofweek.to_numpy(), dtype=WEEKDAY_DTYPE)
+    return df
+
+
+def add_time_features(df, hhmmss):
+    """HHMMSS形式の整数の時刻から時刻・時間の列を作る
+
+    時刻はdatetime.timeのオブジェクトではなくHHMMSS形式の整数のまま保持する。
+    """
+    hhmmss = pd.to_numeric(pd.Series(hhmmss, index=df.index)).astype('int64')
+    df['時刻'] = hhmmss.astype('int32')
+    df['時間'] = (hhmmss // 10000).astype('int8')
+    return df
+
+# 枚数・金額の列に使う整数型の範囲
+UINT16_MAX = 2 ** 16 - 1
+UINT32_MAX = 2 ** 32 - 1
+
+
+def compact_dtypes(df):
+    """メモリを節約するため列を値の範囲に収まる小さな型に変換
+
+    枚数はuint16（収まらなければuint32）、0以上の金額はuint32、曜日は
+    カテゴリ型にする。符号なしの列同士の引き算は桁あふれするため、
+    差を求める集計では先に符号付きの型へ変換すること。
+    """
+    for col in df.columns:
+        if not ('枚数' in col or '金額' in col) or not pd.api.types.is_integer_dtype(df[col]):
+            continue
+        if df.empty or df[col].min() < 0:
+            continue
+        top = df[col].max()
+        if '枚数' in col and top <= UINT16_MAX:
+            df[col] = df[col].astype('uint16')
+        elif top <= UINT32_MAX:
+            df[col] = df[col].astype('uint32')
+    if '曜日' in df.columns:
+        df['曜日'] = df['曜日'].astype(WEEKDAY_DTYPE)
+    return df
+
+
+def process_atm_frame(atm_df):
+    """ATM精算データの変換（行ごとに独立しているため追記分にも使える）
+
+    集計キューブで使う時間の列と曜日の列もここで一度だけ作り、表示の
+    たびに文字列から解析し直さないようにする。日の分類（7の日・給与日・
+    月末）は日次の予測でしか使わないため、行ごとには持たず日付から求める。
+    """
+    # 日付と時刻の変換
+    atm_df['日付'] = ymd_to_datetime(atm_df['日付'])
+    add_calendar_features(atm_df)
+    add_time_features(atm_df, atm_df['時刻'])
+    compact_dtypes(atm_df)
+
+    # 月・日単位で切り出せるよう日付順に並べる
+    return sort_by_date(atm_df)
+
+
+# データの種類ごとの金種別の枚数の列（空白を除いた列名全体と一致させ、金種を取り出す）
+# ATM精算データには在高（N円）枚数などの列もあるが、精算枚数はATMへの入金枚数の列だけを使う
+COUNT_COLUMN_PATTERNS = {
+    'pos_withdrawal': re.compile(r'出金枚数[（(](\d+)円[）)]'),
+    'bank_deposit': re.compile(r'預入枚数[（(](\d+)円[）)]'),
+    'bank_exchange': re.compile(r'両替枚数[（(](\d+)円[）)]'),
+    'atm_settlement': re.compile(r'ATM現金[（(]手入力以外[）)]入金[（(](\d+)円[）)]枚数')
+}
+
+
+class HeaderMapping:
+    """現金フローデータの列名から正規化した列名への対応表
+
+    renamesは元の列名から{接頭辞}_{金種}円への対応で、データの種類ごとの
+    枚数の列（COUNT_COLUMN_PATTERNS）だけを対象にする。同じ金種に複数の列が
+    対応する場合は後の列を使い、duplicatesに候補の列をすべて記録する。
+    unmappedは枚数の列の形式だが金種が正しくない列。
+    """
+
+    def __init__(self, columns, key):
+        prefix = CASH_FLOW_PREFIXES[key]
+        pattern = COUNT_COLUMN_PATTERNS[key]
+        self.renames = {}
+        self.unmapped = []
+        self.duplicates = {}
+        sources = {}
+        for col in columns:
+            match = pattern.fullmatch(col.replace(' ', ''))
+            if match is None:
+                continue
+            if match.group(1) not in DENOMINATION_VALUES:
+                self.unmapped.append(col)
+                continue
+            new_col = f'{prefix}_{match.group(1)}円'
+            if new_col in sources:
+                self.duplicates.setdefault(new_col, [sources[new_col]]).append(col)
+                del self.renames[sources[new_col]]
+            sources[new_col] = col
+            self.renames[col] = new_col
+
+    def apply(self, df):
+        """列名を付け替える（データはコピーしない）"""
+        df.columns = [self.renames.get(col, col) for col in df.columns]
+        return df
+
+
+_header_mappings = {}
+_header_mappings_lock = threading.Lock()
+
+
+def header_mapping(columns, key):
+    """ヘッダーの列の並びごとに一度だけ対応表を作って再利用"""
+    signature = (key, tuple(columns))
+    with _header_mappings_lock:
+        mapping = _header_mappings.get(signature)
+    if mapping is not None:
+        return mapping
+
+    mapping = HeaderMapping(columns, key)
+    logger.debug("列名の対応表を作成: %s（%d列）", key, len(mapping.renames))
+    if mapping.unmapped:
+        logger.warning("金種を特定できない枚数の列: %s", mapping.unmapped)
+    for new_col, candidates in mapping.duplicates.items():
+        logger.warning("%sに複数の列が対応するため後の列を使用: %s", new_col, candidates)
+    with _header_mappings_lock:
+        _header_mappings[signature] = mapping
+    return mapping
+
+
+def process_cash_flow_frame(df, key):
+    """現金フローデータの変換（行ごとに独立しているため追記分にも使える）"""
+    # 日付の変換
+    if '日付' in df.columns:
+        df['日付'] = ymd_to_datetime(df['日付'])
+
+    # 金種ごとの枚数の列名を正規化
+    with span('column_mapping', kind=key):
+        header_mapping(df.columns, key).apply(df)
+
+    return sort_by_date(compact_dtypes(df))
+
+
+def sort_by_date(df):
+    """日付順に並べる（同じ日の行はファイルの順序を保つ）"""
+    if '日付' not in df.columns or df['日付'].is_monotonic_increasing:
+        return df
+    return df.sort_values('日付', kind='stable', ignore_index=True)
+
+
+def process_frame(df, kind):
+    """データの種類に応じて読み込んだデータを変換"""
+    if kind == 'atm':
+        return process_atm_frame(df)
+    return process_cash_flow_frame(df, kind)
+
+
+# 読み込み済み範囲のハッシュを計算するときに一度に読むバイト数
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def _range_hasher(f, end):
+    """ファイルの先頭からendまでを読んだblake2bのハッシュオブジェクト
+
+    続けてupdateすれば、読み込み済み範囲を読み直さずに追記分を加えられる。
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    remaining = end
+    while remaining > 0:
+        chunk = f.read(min(HASH_CHUNK_BYTES, remaining))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        remaining -= len(chunk)
+    return hasher
+
+
+def capture_ingest_state(path, encoding):
+    """追記読み込みのために読み込み位置と読み込み済み範囲のハッシュを記録
+
+    最終行が改行で終わっていない（書き込み途中の）ファイルは追記の
+    境界が決められないためNoneを返し、次の変更時は全体を読み直す。
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        if f.read(1) != b'\n':
+            return None
+        content_hash = _range_hasher(f, size).hexdigest()
+
+    return {
+        'offset': size,
+        'rows': 0,
+        'encoding': encoding,
+        'columns': [],
+        'content_hash': content_hash
+    }
+
+
+def read_appended_rows(path, state):
+    """前回の読み込み位置以降に追記された行だけを読み込む
+
+    (追記された行, 新しい状態)を返す。読み込み済みの範囲全体のハッシュが
+    一致しない（ファイルが切り詰められたり、途中が書き換えられたりした）
+    場合は追記とみなせないためNoneを返す。
+    """
+    offset = state['offset']
+    size = os.path.getsize(path)
+    if size < offset:
+        return None
+
+    with open(path, 'rb') as f:
+        hasher = _range_hasher(f, offset)
+        if hasher.hexdigest() != state['content_hash']:
+            return None
+        data = f.read(size - offset)
+
+    # 書き込み途中の最終行は次回に回す
+    data = data[:data.rfind(b'\n') + 1]
+    hasher.update(data)
+
+    columns = state['columns']
+    if data.strip():
+        try:
+            chunk = pd.read_csv(io.BytesIO(data), header=None, names=columns,
+                                encoding=state['encoding'], dtype=declared_dtypes(columns))
+        except (ValueError, TypeError):
+            chunk = pd.read_csv(io.BytesIO(data), header=None, names=columns, encoding=state['encoding'])
+    else:
+        chunk = pd.DataFrame(columns=columns)
+
+    new_state = dict(state, offset=offset + len(data), rows=state['rows'] + len(chunk),
+                     content_hash=hasher.hexdigest())
+    return chunk, new_state
+
+
+def load_file(path, kind):
+    """ファイル全体を読み込んで変換し、追記読み込み用の状態と一緒に返す"""
+    name = os.path.basename(path)
+    with span('read_csv', file=name):
+        encoding = detect_encoding(path)
+        state = capture_ingest_state(path, encoding)
+        raw_df = read_branch_csv(path, encoding)
+
+    # 解析中にファイルが伸びた場合は読み込み位置が分からないため記録しない
+    if state is not None and os.path.getsize(path) != state['offset']:
+        state = None
+    if state is not None:
+        state.update(columns=list(raw_df.columns), rows=len(raw_df))
+
+    with span('parse', file=name, rows=len(raw_df)):
+        return process_frame(raw_df, kind), state
+
+
+class DatasetCache:
+    """プロセス全体で共有する読み込み済みデータのキャッシュ
+
+    Streamlitは操作のたびにスクリプトを再実行するが、このモジュールは
+    再読み込みされないため、解析済みのデータフレームを再利用できる。
+    キャッシュしたデータフレームは共有されるため読み取り専用として扱うこと。
+    """
+
+    def __init__(self, use_sidecar=True):
+        self.use_sidecar = use_sidecar
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._lineage = {}
+        self.hits = 0
+        self.sidecar_hits = 0
+        self.misses = 0
+        self.appends = 0
+
+    def get_or_load(self, path, kind):
+        """キャッシュを参照し、ファイルが変更されていれば再読み込み
+
+        メモリ上にない場合はサイドカーを優先する。ファイルに行が
+        追記されただけなら追記分だけを解析し、それ以外の変更や
+        サイドカーがない場合にファイル全体を解析する。
+        """
+        fingerprint, value = self._lookup(path, kind)
+        if value is None:
+            value, state = load_file(path, kind)
+            self._store(path, kind, fingerprint, value, state)
+        return value
+
+    def load_many(self, tasks, max_workers=None, executor=None):
+        """複数ファイルをワーカープールで並列に読み込む
+
+        tasksは(パス, 種類)のリストで、結果は同じキーの辞書として返す。
+        失敗したファイルは例外オブジェクトを値にして返し、他のファイルの
+        読み込みは継続する。
+        """
+        max_workers = max_workers or LOAD_WORKERS
+        executor = executor or LOAD_EXECUTOR
+        results = {}
+        if not tasks:
+            return results
+
+        if executor == 'process':
+            # キャッシュとサイドカーの確認は親プロセスで行い、解析だけを子プロセスに任せる
+            pending = {}
+            for path, kind in tasks:
+                try:
+                    fingerprint, value = self._lookup(path, kind)
+                except Exception as e:
+                    results[(path, kind)] = e
+                    continue
+                if value is None:
+                    pending[(path, kind)] = fingerprint
+                else:
+                    results[(path, kind)] = value
+
+            if pending:
+                with process_pool(max_workers) as pool:
+                    futures = {task: pool.submit(load_file, *task) for task in pending}
+                    for task, future in futures.items():
+                        try:
+                            value, state = future.result()
+                            self._store(task[0], task[1], pending[task], value, state)
+                            results[task] = value
+                        except Exception as e:
+                            results[task] = e
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                # 計測区間の記録先を各スレッドに引き継ぐ
+                futures = {
+                    task: pool.submit(contextvars.copy_context().run, self.get_or_load, *task)
+                    for task in tasks
+                }
+                for task, future in futures.items():
+                    try:
+                        results[task] = future.result()
+                    except Exception as e:
+                        results[task] = e
+
+        return results
+
+    def _lookup(self, path, kind):
+        """メモリ上のキャッシュ、次にサイドカーを参照し、可能なら追記分を反映"""
+        fingerprint = file_fingerprint(path)
+        key = (fingerprint[0], kind)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                return fingerprint, entry[1]
+
+        base = None
+        if entry is not None:
+            base = entry[1], entry[2]
+        elif self.use_sidecar:
+            sidecar = read_sidecar(path, kind, fingerprint)
+            if sidecar is not None:
+                value, fresh, state = sidecar
+                if fresh:
+                    self._remember(key, fingerprint, value, state)
+                    with self._lock:
+                        self.sidecar_hits += 1
+                    return fingerprint, value
+                base = value, state
+
+        if base is not None and base[1] is not None:
+            value = self._append(path, kind, fingerprint, *base)
+            if value is not None:
+                return fingerprint, value
+        return fingerprint, None
+
+    def _append(self, path, kind, fingerprint, value, state):
+        """追記された行だけを解析して既存のデータフレームに連結"""
+        try:
+            with span('read_appended', file=os.path.basename(path)):
+                appended = read_appended_rows(path, state)
+        except Exception as e:
+            logger.warning("追記分の読み込みエラー: %s: %s", path, e)
+            appended = None
+        if appended is None:
+            logger.info("追記以外の変更のためファイル全体を読み込みます: %s", path)
+            return None
+
+        chunk, new_state = appended
+        if len(chunk):
+            rows = process_frame(chunk, kind)
+            # 追記分がすべて既存の行以降の日付なら、既存の行がそのまま先頭に残る
+            in_order = ('日付' not in rows.columns or value.empty or rows.empty
+                        or rows['日付'].min() >= value['日付'].max())
+            base, value = value, sort_by_date(pd.concat([value, rows], ignore_index=True))
+            if in_order:
+                self._record_lineage(value, base)
+        logger.info("追記分を読み込みました: %s（%d行）", path, len(chunk))
+
+        if self.use_sidecar:
+            write_sidecar(path, kind, fingerprint, value, new_state)
+        self._remember((fingerprint[0], kind), fingerprint, value, new_state)
+        with self._lock:
+            self.appends += 1
+        return value
+
+    def _record_lineage(self, value, base):
+        key = id(value)
+
+        def discard(_ref, key=key):
+            self._lineage.pop(key, None)
+
+        with self._lock:
+            self._lineage[key] = (weakref.ref(value, discard), id(base), len(base))
+
+    def lineage(self, value):
+        """追記で作ったデータフレームなら(元のデータフレームのid, 元の行数)を返す
+
+        元のデータフレームの行が変わらずに先頭に並んでいる場合だけ記録する
+        ため、その行数より後ろが追記された行になる。
+        """
+        with self._lock:
+            entry = self._lineage.get(id(value))
+        if entry is None or entry[0]() is not value:
+            return None
+        return entry[1], entry[2]
+
+    def _store(self, path, kind, fingerprint, value, state):
+        """解析結果をサイドカーとメモリ上のキャッシュに保存"""
+        if self.use_sidecar:
+            write_sidecar(path, kind, fingerprint, value, state)
+        self._remember((fingerprint[0], kind), fingerprint, value, state)
+        with self._lock:
+            self.misses += 1
+
+    def _remember(self, key, fingerprint, value, state):
+        with self._lock:
+            self._entries[key] = (fingerprint, value, state)
+
+    def stats(self):
+        """ヒット数（メモリ・サイドカー）・ミス数・追記読み込み数・エントリ数を返す"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'sidecar_hits': self.sidecar_hits,
+                'misses': self.misses,
+                'appends': self.appends,
+                'entries': len(self._entries)
+            }
+
+    def clear(self):
+        """キャッシュと統計をすべて破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._lineage.clear()
+            self.hits = 0
+            self.sidecar_hits = 0
+            self.misses = 0
+            self.appends = 0
+
+
+# プロセス全体で共有するキャッシュ
+DATASET_CACHE = DatasetCache()
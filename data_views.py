@@ -0,0 +1,485 @@
+import itertools
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CASH_FLOW_PREFIXES, DATASET_CACHE, DENOMINATION_VALUES, WEEKDAY_LABELS
+from tracing import span
+
+_derived = {}
+_derived_lock = threading.Lock()
+
+
+def derived(source, name, builder):
+    """データフレームから作った派生データをプロセス全体で再利用
+
+    キャッシュ済みのデータフレームは読み取り専用のため、同じオブジェクト
+    であれば派生データも変わらない。sourceにはデータフレームまたはその
+    タプルを渡し、元のデータフレームが解放されると派生データも破棄する。
+    """
+    frames = source if isinstance(source, tuple) else (source,)
+    key = (tuple(id(frame) for frame in frames), name)
+    with _derived_lock:
+        entry = _derived.get(key)
+        if entry is not None and all(ref() is frame for ref, frame in zip(entry[0], frames)):
+            return entry[1]
+
+    value = builder(source)
+
+    # ガベージコレクションはロックを保持している最中にも走るため、
+    # コールバックではロックを取らない（dict.popは単独で原子的）
+    def discard(_ref, key=key):
+        _derived.pop(key, None)
+
+    with _derived_lock:
+        _derived[key] = (tuple(weakref.ref(frame, discard) for frame in frames), value)
+    return value
+
+
+class DatePartitions:
+    """日付列の月・日単位の索引
+
+    月や任意の期間の抽出は二分探索で位置を求めてilocで切り出すため、
+    履歴全体の長さに比例した処理が発生しない。索引は日付の配列と位置
+    だけを持ち、元のデータフレームは抽出のたびに受け取る（derivedの
+    キャッシュが元のデータフレームを参照し続けないようにするため）。
+    """
+
+    def __init__(self, df, date_col='日付'):
+        self.date_col = date_col
+        dates = df[date_col].to_numpy(dtype='datetime64[ns]')
+
+        # 日付順でなければ並べ替えの順序を持ち、抽出はその順序で取り出す
+        self._order = None
+        if not df[date_col].is_monotonic_increasing:
+            self._order = np.argsort(dates, kind='stable')
+            dates = dates[self._order]
+        self._dates = dates
+
+        # 日ごと・月ごとの開始位置
+        days = self._dates.astype('datetime64[D]')
+        self.days, self._day_starts = np.unique(days, return_index=True)
+        self._months = np.unique(self.days.astype('datetime64[M]'))
+
+    @property
+    def months(self):
+        """データが存在する月の一覧（pd.Period）"""
+        return [pd.Period(month, freq='M') for month in self._months]
+
+    def _slice(self, df, start, stop):
+        a = np.searchsorted(self._dates, np.datetime64(start, 'ns'), side='left')
+        b = np.searchsorted(self._dates, np.datetime64(stop, 'ns'), side='left')
+        if self._order is None:
+            return df.iloc[a:b]
+        return df.iloc[np.sort(self._order[a:b])]
+
+    def month(self, df, period):
+        """索引を作ったデータフレームから指定した月の行を抽出"""
+        period = pd.Period(period, freq='M')
+        return self._slice(df, period.start_time, (period + 1).start_time)
+
+    def range(self, df, start, end):
+        """索引を作ったデータフレームから開始日から終了日（当日を含む）までの行を抽出"""
+        start = pd.Timestamp(start).normalize()
+        stop = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+        return self._slice(df, start, stop)
+
+
+def date_partitions(df, date_col='日付'):
+    """データフレームの日付索引（同じデータフレームでは作り直さない）"""
+    return derived(df, f'partitions:{date_col}', lambda d: DatePartitions(d, date_col))
+
+
+# 集計キューブのバージョン（作り直すたびに増える。描画済みグラフのキャッシュのキーに使う）
+_cube_versions = itertools.count(1)
+
+# 集計キューブで扱う列
+BALANCE_COL = '在高合計金額'
+DEPOSIT_AMOUNT_COL = 'ATM現金入金計金額'
+DEPOSIT_COUNT_COL = 'ATM現金入金取引'
+
+
+class AggregateCube:
+    """支店の取引を日付×時間帯×金種の粒度で事前集計したキューブ
+
+    列ごとの合計・件数（欠損を除く）と在高の最大値を保持し、平均は
+    合計÷件数で求める。各ページは取引明細ではなくこのキューブを集計する
+    ため、ページの処理時間は取引件数に依存しない。
+    """
+
+    def __init__(self, df, value_cols):
+        values = df[[col for col in value_cols if col in df.columns]].copy()
+        if BALANCE_COL in df.columns:
+            values[BALANCE_COL] = df[BALANCE_COL]
+        if DEPOSIT_AMOUNT_COL in df.columns:
+            values[DEPOSIT_COUNT_COL] = (df[DEPOSIT_AMOUNT_COL] > 0).astype(int)
+
+        grouped = values.groupby([df['日付'].rename('日付'), df['時間'].rename('hour')], sort=True)
+        self.sums = grouped.sum()
+        self.counts = grouped.count()
+        self.rows = grouped.size()
+        self.maxes = grouped[[BALANCE_COL]].max() if BALANCE_COL in values.columns else None
+
+        self.version = next(_cube_versions)
+
+        # 日付ごとの曜日と表示用のラベル（例: 11/01(水)）
+        dates = self.rows.index.get_level_values('日付').unique()
+        self.weekdays = pd.Series(np.array(WEEKDAY_LABELS)[dates.dayofweek], index=dates)
+        self.labels = dates.strftime('%m/%d') + '(' + self.weekdays + ')'
+
+    def date_labels(self, dates):
+        """日付の表示用ラベルのリスト"""
+        return self.labels.reindex(dates).tolist()
+
+    def _month(self, frame, period):
+        period = pd.Period(period, freq='M')
+        start = period.start_time
+        end = (period + 1).start_time - pd.Timedelta(days=1)
+        return frame.loc[start:end]
+
+    def row_count(self, period):
+        """月の取引件数"""
+        return int(self._month(self.rows, period).sum())
+
+    def mean(self, period, col):
+        """月全体の平均"""
+        return self._month(self.sums, period)[col].sum() / self._month(self.counts, period)[col].sum()
+
+    def max(self, period, col=BALANCE_COL):
+        """月全体の最大値"""
+        return self._month(self.maxes, period)[col].max()
+
+    def hourly_sum(self, period, col):
+        """時間帯別の合計"""
+        return self._month(self.sums, period)[col].groupby(level='hour').sum()
+
+    def daily_mean(self, period, col):
+        """日別の平均"""
+        sums = self._month(self.sums, period)[col].groupby(level='日付').sum()
+        counts = self._month(self.counts, period)[col].groupby(level='日付').sum()
+        return sums / counts
+
+    def hour_date_mean(self, period, col):
+        """時間帯×日付の平均（行が時間帯、列が日付）"""
+        sums = self._month(self.sums, period)[col]
+        counts = self._month(self.counts, period)[col]
+        return (sums / counts).unstack(level='日付')
+
+
+def branch_cube(df, value_cols):
+    """支店の集計キューブ（同じデータフレームでは作り直さない）"""
+    value_cols = tuple(value_cols)
+
+    def build(d):
+        with span('aggregate', view='cube', rows=len(d)):
+            return AggregateCube(d, value_cols)
+
+    return derived(df, f'cube:{value_cols}', build)
+
+
+# 現金フローの種類と表示名
+FLOW_SOURCES = {
+    'pos_withdrawal': '①補充',
+    'bank_deposit': '②預入',
+    'bank_exchange': '③両替',
+    'atm_settlement': '④精算'
+}
+FLOW_TOTAL = '⑤合計'
+
+
+SOURCE_DTYPE = pd.CategoricalDtype(list(FLOW_SOURCES.values()), ordered=True)
+DENOMINATION_DTYPE = pd.CategoricalDtype(DENOMINATION_VALUES, ordered=True)
+
+
+def _build_ledger(cash_flow_data):
+    """支店の現金フローを縦持ちの台帳にまとめる
+
+    列はbranch, 日付, source（①補充〜④精算）, denomination, count。
+    支店・日付順に並べ、キーはカテゴリ型で保持する。枚数が0の組み合わせは
+    持たない。
+    """
+    branch_names = sorted(cash_flow_data)
+    source_codes = {label: code for code, label in enumerate(SOURCE_DTYPE.categories)}
+    denomination_codes = {value: code for code, value in enumerate(DENOMINATION_DTYPE.categories)}
+
+    # キーの列は文字列の配列を作らず、カテゴリのコード（整数）を直接並べる
+    branches, dates, sources, denominations, counts = [], [], [], [], []
+    for code, data in cash_flow_data.items():
+        branch_code = branch_names.index(code)
+        for key, label in FLOW_SOURCES.items():
+            df = data.get(key)
+            if df is None:
+                continue
+            cols = [(f'{CASH_FLOW_PREFIXES[key]}_{value}円', value) for value in DENOMINATION_VALUES]
+            cols = [(col, value) for col, value in cols if col in df.columns]
+            if not cols:
+                continue
+
+            # 行×金種の枚数を1列に並べ、枚数が0または欠損の組み合わせは除く
+            values = df[[col for col, _ in cols]].to_numpy(dtype=float)
+            keep = np.nan_to_num(values) != 0
+            rows, positions = np.nonzero(keep)
+            branches.append(np.full(len(rows), branch_code, dtype='int16'))
+            dates.append(df['日付'].to_numpy()[rows])
+            sources.append(np.full(len(rows), source_codes[label], dtype='int8'))
+            denominations.append(np.array([denomination_codes[value] for _, value in cols], dtype='int8')[positions])
+            counts.append(np.rint(values[keep]).astype('int32'))
+
+    if not counts:
+        return pd.DataFrame({
+            'branch': pd.Categorical([]),
+            '日付': pd.Series(dtype='datetime64[ns]'),
+            'source': pd.Categorical([], dtype=SOURCE_DTYPE),
+            'denomination': pd.Categorical([], dtype=DENOMINATION_DTYPE),
+            'count': pd.Series(dtype='int32')
+        })
+    ledger = pd.DataFrame({
+        'branch': pd.Categorical.from_codes(np.concatenate(branches), categories=branch_names),
+        '日付': np.concatenate(dates),
+        'source': pd.Categorical.from_codes(np.concatenate(sources), dtype=SOURCE_DTYPE),
+        'denomination': pd.Categorical.from_codes(np.concatenate(denominations), dtype=DENOMINATION_DTYPE),
+        'count': np.concatenate(counts)
+    })
+    return ledger.sort_values(['branch', '日付', 'source', 'denomination'], kind='stable', ignore_index=True)
+
+
+def _ledger_parts(ledger):
+    """台帳を支店ごとに分ける（{支店: 台帳}、branchは支店だけのカテゴリ型）"""
+    parts = {}
+    for code, part in ledger.groupby('branch', observed=True, sort=False):
+        part = part.reset_index(drop=True)
+        part['branch'] = pd.Categorical.from_codes(np.zeros(len(part), dtype='int8'), categories=[str(code)])
+        parts[str(code)] = part
+    return parts
+
+
+def _concat_ledgers(ledgers):
+    """支店ごとの台帳（追記分を含む）を支店順に連結し、branchのカテゴリをそろえる"""
+    codes = sorted(ledgers)
+    parts = [part for code in codes for part in ledgers[code]]
+    if not parts:
+        return _build_ledger({})
+    ledger = pd.concat(parts, ignore_index=True)
+    ledger['branch'] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(codes)), [sum(len(part) for part in ledgers[code]) for code in codes]),
+        categories=codes
+    )
+    return ledger
+
+
+FLOW_COLUMNS = list(FLOW_SOURCES.values())
+FLOW_TABLE_COLUMNS = ['branch', 'denomination', '日付'] + FLOW_COLUMNS + [FLOW_TOTAL]
+
+
+def _flow_sums(ledger):
+    """台帳を支店ごとに金種×日×種類で合計（{支店: 金種×日の表}、取引のない日は含まない）"""
+    sums = ledger.groupby(['branch', 'denomination', '日付', 'source'], observed=True)['count'].sum()
+    sums = sums.astype('int64').unstack('source', fill_value=0).reindex(columns=FLOW_COLUMNS, fill_value=0)
+    sums.columns.name = None
+    return {
+        str(code): part.droplevel('branch').rename(index=str, level='denomination')
+        for code, part in sums.groupby(level='branch', observed=True)
+    }
+
+
+def _calendar(start, end):
+    """金種×日のすべての組み合わせ（金種・日付順）"""
+    days = pd.date_range(start, end).to_numpy()
+    return pd.MultiIndex.from_arrays(
+        [np.repeat(np.array(DENOMINATION_VALUES, dtype=object), len(days)),
+         np.tile(days, len(DENOMINATION_VALUES))],
+        names=['denomination', '日付']
+    )
+
+
+def _date_span(frames):
+    """データフレームの日付の最小値と最大値（行がなければNone）"""
+    dates = [df['日付'] for df in frames if '日付' in df.columns and len(df)]
+    if not dates:
+        return None
+    return min(d.min() for d in dates), max(d.max() for d in dates)
+
+
+class DailyFlowView:
+    """全支店・全金種・全日の現金フローのマテリアライズドビュー
+
+    支店ごとに縦持ちの台帳（_build_ledger）と、それを集計した金種×日の
+    ①補充〜④精算の合計を保持する。前回集計したデータフレームに行が
+    追記されただけ（DatasetCache.lineage）の支店は追記された行の台帳を
+    加えてその分だけを集計して加算し、それ以外の変更があった支店だけを
+    台帳から作り直す。versionは表の内容が変わるたびに増える。
+    """
+
+    def __init__(self, cache=DATASET_CACHE):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._frames = {}
+        self._flows = {}
+        self._ledgers = {}
+        self._ledger = None
+        self._table = None
+        self.version = 0
+        self.rebuilds = 0
+        self.increments = 0
+
+    def _tails(self, code, data):
+        """前回集計したデータフレームに追記された行（追記以外の変更があればNone）"""
+        previous = self._frames.get(code)
+        if previous is None or set(previous) != set(data):
+            return None
+        tails = {}
+        for key, df in data.items():
+            if df is previous[key]:
+                continue
+            if self.cache.lineage(df) != (id(previous[key]), len(previous[key])):
+                return None
+            tails[key] = df.iloc[len(previous[key]):]
+        return tails
+
+    def _rebuild(self, branches):
+        ledger = _build_ledger(branches)
+        parts = _ledger_parts(ledger)
+        for code in branches:
+            self._ledgers[code] = [parts[code]] if code in parts else []
+        sums = _flow_sums(ledger)
+        for code, data in branches.items():
+            date_span = _date_span(data.values())
+            if date_span is None:
+                self._flows.pop(code, None)
+                self._ledgers.pop(code, None)
+                continue
+            self._flows[code] = sums.get(code, pd.DataFrame(columns=FLOW_COLUMNS, dtype='int64')) \
+                .reindex(_calendar(*date_span), fill_value=0)
+        self.rebuilds += len(branches)
+
+    def _append(self, branches):
+        ledger = _build_ledger(branches)
+        for code, part in _ledger_parts(ledger).items():
+            self._ledgers.setdefault(code, []).append(part)
+        sums = _flow_sums(ledger)
+        for code, tails in branches.items():
+            flows = self._flows.get(code)
+            date_span = _date_span(tails.values())
+            if date_span is None:
+                continue
+            if flows is not None:
+                dates = flows.index.get_level_values('日付')
+                date_span = min(date_span[0], dates.min()), max(date_span[1], dates.max())
+                flows = flows.reindex(_calendar(*date_span), fill_value=0)
+            else:
+                flows = pd.DataFrame(0, index=_calendar(*date_span), columns=FLOW_COLUMNS, dtype='int64')
+            if code in sums:
+                flows = flows + sums[code].reindex(flows.index, fill_value=0)
+            self._flows[code] = flows
+        self.increments += len(branches)
+
+    def update(self, cash_flow_data):
+        """読み込み済みの現金フローデータを反映した日次フロー表を返す"""
+        with self._lock:
+            removed = set(self._flows) - set(cash_flow_data)
+            for code in removed:
+                self._flows.pop(code, None)
+                self._frames.pop(code, None)
+                self._ledgers.pop(code, None)
+
+            rebuild, append = {}, {}
+            for code, data in cash_flow_data.items():
+                previous = self._frames.get(code)
+                if previous is not None and set(previous) == set(data) \
+                        and all(previous[key] is df for key, df in data.items()):
+                    continue
+                tails = self._tails(code, data)
+                if tails is None:
+                    rebuild[code] = data
+                else:
+                    append[code] = tails
+
+            if rebuild:
+                with span('aggregate', view='daily_flows', rebuild=','.join(sorted(rebuild))):
+                    self._rebuild(rebuild)
+            if append:
+                with span('aggregate', view='daily_flows', append=','.join(sorted(append))):
+                    self._append(append)
+            for code in list(rebuild) + list(append):
+                self._frames[code] = dict(cash_flow_data[code])
+
+            if removed or rebuild or append or self._table is None:
+                self._table = self._combine()
+                self._ledger = None
+                self.version += 1
+            return self._table
+
+    @property
+    def ledger(self):
+        """集計に使った全支店の台帳をまとめた表（内容が変わるまで同じ表を返す）"""
+        with self._lock:
+            if self._ledger is None:
+                self._ledger = _concat_ledgers(self._ledgers)
+            return self._ledger
+
+    def _combine(self):
+        if not self._flows:
+            return pd.DataFrame(columns=FLOW_TABLE_COLUMNS)
+        table = pd.concat({code: self._flows[code] for code in sorted(self._flows)}, names=['branch']).reset_index()
+        table[FLOW_TOTAL] = table['①補充'] - table['②預入'] + table['③両替'] - table['④精算']
+        table['branch'] = table['branch'].astype('category')
+        return table[FLOW_TABLE_COLUMNS]
+
+
+# プロセス全体で共有する日次フローのビュー
+DAILY_FLOW_VIEW = DailyFlowView()
+
+
+def daily_flow_table(cash_flow_data):
+    """全支店・全金種の日次の現金フロー（①補充〜④精算と⑤合計）
+
+    支店ごとにデータ期間内のすべての日を含み、取引のない日は0とする。
+    共有のビューから返すため、データが変わらない限り同じ表を再利用する。
+    """
+    return DAILY_FLOW_VIEW.update(cash_flow_data)
+
+
+def cash_flow_ledger(cash_flow_data):
+    """全支店の現金フローの縦持ちの台帳（列はbranch, 日付, source, denomination, count）
+
+    日次フローのビューが集計に使っている台帳をそのまま返す。支店ごとに
+    日付順で、追記された行はその支店の末尾に続く。共有するため読み取り
+    専用として扱うこと。
+    """
+    DAILY_FLOW_VIEW.update(cash_flow_data)
+    return DAILY_FLOW_VIEW.ledger
+
+
+def branch_flows(flows, code):
+    """日次フロー表から支店の行を取り出す
+
+    支店ごとの行の位置は表ごとに一度だけ求めて再利用するため、操作の
+    たびに表全体を走査しない。
+    """
+    def build(f):
+        return f.groupby('branch', observed=True, sort=False).indices
+
+    rows = derived(flows, 'branch_rows', build).get(code)
+    if rows is None:
+        return flows.iloc[:0]
+    return flows.iloc[rows]
+
+
+def memory_report(branch_data, cash_flow_data):
+    """支店ごとに保持しているデータの行数とメモリ使用量（MB）"""
+    rows = []
+    for code in sorted(set(branch_data) | set(cash_flow_data)):
+        atm_df = branch_data.get(code, {}).get('atm_df')
+        flow_frames = list(cash_flow_data.get(code, {}).values())
+        atm_bytes = atm_df.memory_usage(deep=True).sum() if atm_df is not None else 0
+        flow_bytes = sum(df.memory_usage(deep=True).sum() for df in flow_frames)
+        rows.append({
+            '支店': code,
+            '行数': (len(atm_df) if atm_df is not None else 0) + sum(len(df) for df in flow_frames),
+            'ATM精算(MB)': atm_bytes / 1024 ** 2,
+            '現金フロー(MB)': flow_bytes / 1024 ** 2,
+            '合計(MB)': (atm_bytes + flow_bytes) / 1024 ** 2
+        })
+    return pd.DataFrame(rows, columns=['支店', '行数', 'ATM精算(MB)', '現金フロー(MB)', '合計(MB)'])
@@ -0,0 +1,406 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import PAYDAY
+from data_views import FLOW_SOURCES, FLOW_TOTAL, derived
+from tracing import process_pool, span
+
+# 7のつく日（7,17,27日）を表す分類キー（曜日は0-6）
+SEVENTH_DAY_CLASS = 7
+
+# 予測方法の名称
+METHOD_SAME_CLASS = '曜日・7の日ベース'
+METHOD_MODEL = '予測モデル'
+
+# 予測モデルの設定
+MOVING_AVERAGE_DAYS = 30  # 基本予測値の移動平均の日数
+SEASONAL_LAG_DAYS = 365   # 季節調整に使う過去データの最低経過日数
+
+# 特異日の分類（0は通常日）
+SPECIAL_DAY_NAMES = {1: '7の日', 2: '給与日', 3: '月末'}
+
+# 予測対象の系列
+FLOW_SERIES = list(FLOW_SOURCES.values()) + [FLOW_TOTAL]
+
+# バックテストの設定（ATM_BACKTEST_EXECUTORはprocessまたはserial）
+BACKTEST_HORIZONS = (1, 7)   # 何日先を予測するか（1は翌日）
+BACKTEST_STEP = 7            # 予測の起点の間隔（日）
+BACKTEST_MIN_HISTORY = 60    # 最初の起点までに必要なデータの日数
+BACKTEST_EXECUTOR = os.environ.get('ATM_BACKTEST_EXECUTOR', 'process')
+BACKTEST_WORKERS = int(os.environ.get('ATM_BACKTEST_WORKERS', '0')) or None
+
+
+def day_class(dates):
+    """予測に使う日の分類（7のつく日は7、それ以外は曜日0-6）"""
+    dates = pd.DatetimeIndex(dates)
+    return np.where(dates.day % 10 == 7, SEVENTH_DAY_CLASS, dates.dayofweek)
+
+
+def special_day_class(dates):
+    """特異日の分類（1: 7の日, 2: 給与日, 3: 月末, 0: 通常日）"""
+    dates = pd.DatetimeIndex(dates)
+    return np.select(
+        [dates.day % 10 == 7, dates.day == PAYDAY, dates.is_month_end],
+        [1, 2, 3],
+        default=0
+    )
+
+
+def prior_key_mean(values, keys, origins, target_keys, min_age=0, empty=0.0):
+    """時点より前の、同じ分類の日の平均を全系列まとめて計算
+
+    values: 系列×日の配列（欠損はNaN）
+    keys: 各日の分類
+    origins: 予測の起点となる日の位置（この日より前のデータだけを使う）
+    target_keys: 起点ごとに平均を求める分類
+    min_age: 起点から少なくともこの日数だけ前のデータだけを使う
+    empty: 該当する日がない場合の値
+
+    戻り値は系列×起点の配列。分類ごとに累積和を一度取るだけなので、
+    系列数・日数に比例した時間で計算できる。
+    """
+    values = np.atleast_2d(values)
+    n_series = values.shape[0]
+    origins = np.asarray(origins)
+    target_keys = np.asarray(target_keys)
+    cut = np.clip(origins - min_age, 0, None)
+
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    result = np.full((n_series, len(origins)), empty, dtype=float)
+
+    for key in np.unique(target_keys):
+        mask = keys == key
+        # 先頭に0を付けた累積和で、位置tにはt日目より前の合計が入る
+        sums = np.zeros((n_series, values.shape[1] + 1))
+        counts = np.zeros((n_series, values.shape[1] + 1))
+        np.cumsum(filled * mask, axis=1, out=sums[:, 1:])
+        np.cumsum(valid & mask, axis=1, out=counts[:, 1:])
+
+        selected = target_keys == key
+        s = sums[:, cut[selected]]
+        c = counts[:, cut[selected]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[:, selected] = np.where(c > 0, s / c, empty)
+    return result
+
+
+def same_class_forecast(values, dates):
+    """曜日・7の日ベースの予測値を全系列まとめて計算（系列×日の配列）
+
+    7のつく日は過去の7のつく日の平均、それ以外の日は同じ曜日の過去の
+    通常日の平均を予測値とし、過去に同じ分類の日がなければ実績値を使う。
+    分類ごとの累積和（prior_key_mean）で求めるため、複数年の履歴でも
+    日数に比例した時間で計算できる。
+    """
+    values = np.atleast_2d(values)
+    classes = day_class(dates)
+    positions = np.arange(len(classes))
+    forecast = prior_key_mean(values, classes, positions, classes, empty=np.nan)
+    return np.where(np.isnan(forecast), values, forecast)
+
+
+def same_class_mean_forecast(actual):
+    """日付のインデックスを持つ1系列の曜日・7の日ベースの予測値（same_class_forecastと同じ計算）"""
+    actual = actual.sort_index()
+    return pd.Series(same_class_forecast(actual.to_numpy(dtype=float), actual.index)[0], index=actual.index)
+
+
+class CashFlowForecaster:
+    """分析機能説明書の予測モデルを全系列まとめて当てはめる
+
+    系列（支店×金種×現金フローの種類）×日の配列に対し、次の要素を
+    NumPyの一括計算で求める。各日の予測にはその日より前のデータだけを使う。
+
+    - 基本予測値: 直近30日間の移動平均
+    - トレンド: 移動平均の30日間の変化から求めた1日あたりの傾き
+    - 曜日の変動: 移動平均からの乖離の曜日別平均
+    - 特異日補正: 7の日・給与日・月末の乖離の平均
+    - 季節調整: 1年以上前の同じ月の乖離の平均
+
+    流出入の合計は正負どちらにもなるため、係数は比率ではなく
+    移動平均に対する加算値として扱う。
+    """
+
+    def __init__(self, values, dates, window=MOVING_AVERAGE_DAYS):
+        self.values = np.asarray(values, dtype=float)
+        self.dates = pd.DatetimeIndex(dates)
+        self.window = window
+        n_days = self.values.shape[1]
+        positions = np.arange(n_days)
+
+        # 直近window日間（当日を含まない）の移動平均
+        valid = ~np.isnan(self.values)
+        sums = np.zeros((self.values.shape[0], n_days + 1))
+        counts = np.zeros((self.values.shape[0], n_days + 1))
+        np.cumsum(np.where(valid, self.values, 0.0), axis=1, out=sums[:, 1:])
+        np.cumsum(valid, axis=1, out=counts[:, 1:])
+        start = np.clip(positions - window, 0, None)
+        window_counts = counts[:, positions] - counts[:, start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.level = np.where(window_counts > 0,
+                                  (sums[:, positions] - sums[:, start]) / window_counts, np.nan)
+
+        # トレンド（移動平均の1日あたりの変化）
+        previous = np.full_like(self.level, np.nan)
+        if n_days > window:
+            previous[:, window:] = self.level[:, :-window]
+        self.slope = np.nan_to_num((self.level - previous) / window)
+
+        # 各要素は前の要素を除いた残差から順に求める
+        self.weekday_keys = self.dates.dayofweek.to_numpy()
+        self.special_keys = special_day_class(self.dates)
+        self.month_keys = self.dates.month.to_numpy()
+
+        residual = self.values - self.level
+        self.weekday_residual = residual
+        residual = residual - prior_key_mean(residual, self.weekday_keys, positions, self.weekday_keys)
+        self.special_residual = residual
+        residual = residual - self._special_offset(positions, self.special_keys)
+        self.seasonal_residual = residual
+
+    def _special_offset(self, origins, target_keys):
+        offset = prior_key_mean(self.special_residual, self.special_keys, origins, target_keys)
+        return np.where(np.asarray(target_keys) > 0, offset, 0.0)
+
+    def predict(self, origins, targets):
+        """起点の日までのデータで対象日を予測（系列×予測の配列）
+
+        originsとtargetsは日の位置の配列で、origins[i] <= targets[i]。
+        起点と対象日が同じなら1日先の予測になる。
+        """
+        origins = np.asarray(origins)
+        targets = np.asarray(targets)
+        horizon = targets - origins
+
+        # 移動平均は窓の中央の時点の水準のため、トレンドは中央からの日数分を加える
+        prediction = self.level[:, origins] + self.slope[:, origins] * (horizon + (self.window + 1) / 2)
+        prediction = prediction + prior_key_mean(
+            self.weekday_residual, self.weekday_keys, origins, self.weekday_keys[targets])
+        prediction = prediction + self._special_offset(origins, self.special_keys[targets])
+        prediction = prediction + prior_key_mean(
+            self.seasonal_residual, self.month_keys, origins, self.month_keys[targets],
+            min_age=SEASONAL_LAG_DAYS)
+        return prediction
+
+    def one_step(self):
+        """各日をその前日までのデータで予測した値"""
+        positions = np.arange(len(self.dates))
+        return self.predict(positions, positions)
+
+
+def series_matrix(flows):
+    """日次フロー表を系列×日の配列に変換
+
+    戻り値は(配列, 日付, 系列のキー)で、系列のキーは
+    (支店, 金種, 現金フローの種類)のMultiIndex。
+    """
+    wide = flows.set_index(['branch', 'denomination', '日付'])[FLOW_SERIES]
+    wide.columns.name = 'series'
+    matrix = wide.stack().unstack('日付')
+    dates = pd.date_range(matrix.columns.min(), matrix.columns.max())
+    matrix = matrix.reindex(columns=dates)
+    return matrix.to_numpy(dtype=float), dates, matrix.index
+
+
+FORECAST_COLUMNS = ['branch', 'denomination', 'series', '日付', 'method', '実績値', '予測値']
+METHOD_DTYPE = pd.CategoricalDtype([METHOD_SAME_CLASS, METHOD_MODEL])
+
+
+def _build_forecast_table(flows):
+    if flows.empty:
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+
+    values, dates, keys = series_matrix(flows)
+    predictions = {
+        METHOD_SAME_CLASS: same_class_forecast(values, dates),
+        METHOD_MODEL: CashFlowForecaster(values, dates).one_step()
+    }
+
+    # 系列×日を1行とし、支店のデータ期間外の日（実績が欠損）は除く
+    actual = values.ravel()
+    keep = ~np.isnan(actual)
+    n_methods = len(predictions)
+
+    # キーの列はMultiIndexのコードからカテゴリ型を直接作る（文字列の配列を作らない）
+    table = {}
+    for level, name in enumerate(keys.names):
+        codes = np.repeat(keys.codes[level], len(dates))[keep]
+        table[name] = pd.Categorical.from_codes(np.tile(codes, n_methods),
+                                                categories=keys.levels[level].astype(str))
+    table['日付'] = np.tile(np.tile(dates.to_numpy(), len(keys))[keep], n_methods)
+    table['method'] = pd.Categorical.from_codes(np.repeat(np.arange(n_methods), keep.sum()).astype('int8'),
+                                                dtype=METHOD_DTYPE)
+    table['実績値'] = np.tile(actual[keep], n_methods)
+    table['予測値'] = np.concatenate([predicted.ravel()[keep] for predicted in predictions.values()])
+    return pd.DataFrame(table)[FORECAST_COLUMNS]
+
+
+def forecast_table(flows):
+    """全支店・全金種・全系列の予測値（縦持ちの表）
+
+    列はbranch, denomination, series, 日付, method, 実績値, 予測値。
+    methodは曜日・7の日ベースと予測モデルの2種類で、各日の予測値は
+    その日より前のデータだけから求める。曜日・7の日ベースで過去に
+    同じ分類の日がない場合は実績値を使う。
+    """
+    def build(f):
+        with span('forecast', rows=len(f)):
+            return _build_forecast_table(f)
+
+    return derived(flows, 'forecast_table', build)
+
+
+def forecast_slice(forecasts, branch, method, series=FLOW_TOTAL):
+    """予測表から支店・予測方法・系列の行を取り出す
+
+    (支店, 予測方法, 系列)ごとの行の位置は予測表ごとに一度だけ求めて
+    再利用するため、操作のたびに予測表全体を走査しない。
+    """
+    def build(f):
+        return f.groupby(['branch', 'method', 'series'], observed=True, sort=False).indices
+
+    rows = derived(forecasts, 'forecast_groups', build).get((branch, method, series))
+    if rows is None:
+        return forecasts.iloc[:0]
+    return forecasts.iloc[rows]
+
+
+def hourly_profile(branch_data):
+    """支店・金種ごとの時間帯別の需要配分（ATM入金枚数の構成比）"""
+    frames = []
+    for code, data in branch_data.items():
+        cube = data['cube']
+        for col in data['bill_cols'] + data['coin_cols']:
+            hourly = cube.sums[col].groupby(level='hour').sum()
+            total = hourly.sum()
+            if total > 0:
+                frames.append(pd.DataFrame({
+                    'branch': code,
+                    'denomination': col.split('（')[2].split('円')[0],
+                    'hour': hourly.index,
+                    '構成比': (hourly / total).values
+                }))
+    if not frames:
+        return pd.DataFrame(columns=['branch', 'denomination', 'hour', '構成比'])
+    return pd.concat(frames, ignore_index=True)
+
+
+BACKTEST_COLUMNS = ['branch', 'denomination', 'series', 'method', 'horizon', '件数', 'MAE', 'MAPE', 'バイアス']
+
+
+def rolling_origins(n_days, horizons=BACKTEST_HORIZONS, step=BACKTEST_STEP, min_history=BACKTEST_MIN_HISTORY):
+    """バックテストの(起点, 対象日, 何日先)の位置の配列
+
+    起点の日より前のデータだけで、起点からhorizon日目の日を予測する。
+    """
+    starts = np.arange(min_history, n_days, step)
+    origins, targets, labels = [], [], []
+    for horizon in horizons:
+        ends = starts + horizon - 1
+        keep = ends < n_days
+        origins.append(starts[keep])
+        targets.append(ends[keep])
+        labels.append(np.full(keep.sum(), horizon))
+    return np.concatenate(origins), np.concatenate(targets), np.concatenate(labels)
+
+
+def _backtest_errors(values, dates, keys, horizons, step, min_history):
+    """系列のまとまりについて方法×何日先ごとの誤差指標を求める（子プロセスで実行）"""
+    origins, targets, labels = rolling_origins(len(dates), horizons, step, min_history)
+    if len(origins) == 0:
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+
+    classes = day_class(dates)
+    predictions = {
+        METHOD_SAME_CLASS: prior_key_mean(values, classes, origins, classes[targets], empty=np.nan),
+        METHOD_MODEL: CashFlowForecaster(values, dates).predict(origins, targets)
+    }
+    actual = values[:, targets]
+
+    frames = []
+    for method, predicted in predictions.items():
+        error = predicted - actual
+        valid = ~np.isnan(error)
+        nonzero = valid & (actual != 0)
+        for horizon in horizons:
+            cols = labels == horizon
+            v = valid[:, cols]
+            nz = nonzero[:, cols]
+            e = np.where(v, error[:, cols], 0.0)
+            n = v.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ape = np.where(nz, np.abs(e) / np.abs(np.where(nz, actual[:, cols], 1.0)), 0.0)
+                frames.append(pd.DataFrame({
+                    'branch': keys.get_level_values('branch'),
+                    'denomination': keys.get_level_values('denomination'),
+                    'series': keys.get_level_values('series'),
+                    'method': method,
+                    'horizon': horizon,
+                    '件数': n,
+                    'MAE': np.abs(e).sum(axis=1) / n,
+                    'MAPE': ape.sum(axis=1) / nz.sum(axis=1) * 100,
+                    'バイアス': e.sum(axis=1) / n
+                }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _build_backtest(flows, horizons, step, min_history, executor, max_workers):
+    if flows.empty:
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+
+    values, dates, keys = series_matrix(flows)
+    # 支店ごとに分けてワーカーに渡す（各支店の系列は互いに独立）
+    branches = keys.get_level_values('branch')
+    chunks = []
+    for code in branches.unique():
+        rows = np.flatnonzero(branches == code)
+        chunks.append((values[rows], dates, keys[rows], horizons, step, min_history))
+
+    if executor == 'process' and len(chunks) > 1:
+        with process_pool(max_workers) as pool:
+            results = list(pool.map(_backtest_errors, *zip(*chunks)))
+    else:
+        results = [_backtest_errors(*chunk) for chunk in chunks]
+    return pd.concat(results, ignore_index=True)[BACKTEST_COLUMNS]
+
+
+def backtest(flows, horizons=BACKTEST_HORIZONS, step=BACKTEST_STEP, min_history=BACKTEST_MIN_HISTORY,
+             executor=None, max_workers=None):
+    """ローリング起点による予測精度の検証
+
+    履歴のmin_history日目からstep日ごとに起点を置き、起点より前のデータ
+    だけで各horizon日先を予測して実績と比べる。戻り値は支店×金種×系列×
+    方法×何日先ごとの件数・MAE・MAPE（実績0の日を除く、%）・バイアス
+    （予測−実績の平均）。支店ごとにプロセスプールで並列に計算し、結果は
+    同じ日次フロー表・設定であれば再計算しない。
+    """
+    horizons = tuple(horizons)
+    executor = executor or BACKTEST_EXECUTOR
+    max_workers = max_workers or BACKTEST_WORKERS
+
+    def build(f):
+        with span('backtest', rows=len(f), executor=executor):
+            return _build_backtest(f, horizons, step, min_history, executor, max_workers)
+
+    return derived(flows, f'backtest:{horizons}:{step}:{min_history}', build)
+
+
+def backtest_summary(results, by=('method', 'horizon')):
+    """バックテスト結果を件数で加重平均して集計"""
+    by = list(by)
+    weighted = results.assign(
+        _mae=results['MAE'] * results['件数'],
+        _mape=results['MAPE'].fillna(0) * results['件数'],
+        _mape_n=results['件数'].where(results['MAPE'].notna(), 0),
+        _bias=results['バイアス'] * results['件数']
+    ).fillna({'_mae': 0, '_bias': 0})
+    grouped = weighted.groupby(by, sort=False)[['件数', '_mae', '_mape', '_mape_n', '_bias']].sum()
+    return pd.DataFrame({
+        '件数': grouped['件数'],
+        'MAE': grouped['_mae'] / grouped['件数'],
+        'MAPE': grouped['_mape'] / grouped['_mape_n'],
+        'バイアス': grouped['_bias'] / grouped['件数']
+    }).reset_index()
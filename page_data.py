@@ -0,0 +1,284 @@
+import threading
+
+import pandas as pd
+
+from charts import ChartSpec
+from data_loader import CASH_FLOW_FILE_KINDS, DENOMINATION_VALUES, process_atm_frame, process_cash_flow_frame
+from data_views import BALANCE_COL, DEPOSIT_COUNT_COL, FLOW_TOTAL, branch_cube, branch_flows, date_partitions
+from forecast import FLOW_SERIES, forecast_slice
+from synthetic_data import branch_frames
+
+# 紙幣・硬貨の金種と表示名
+BILL_VALUES = DENOMINATION_VALUES[:4]
+COIN_VALUES = DENOMINATION_VALUES[4:]
+DENOMINATION_LABELS = {**{v: f'{v}円札' for v in BILL_VALUES}, **{v: f'{v}円' for v in COIN_VALUES}}
+
+# 金種タイプごとの金種・ATM精算データの列の表示名の接尾辞
+MONEY_TYPES = {
+    '紙幣': (BILL_VALUES, '円札'),
+    '硬貨': (COIN_VALUES, '円玉')
+}
+
+
+def denomination_columns(columns, values):
+    """ATM精算データから指定した金種の入金枚数の列を探す（空白の違いは無視）"""
+    found = []
+    for value in values:
+        pattern = f'ATM現金（手入力以外）入金（{value}円）枚数'
+        found.extend(col for col in columns if col.replace(' ', '') == pattern)
+    return found
+
+
+def column_denomination(col):
+    """入金枚数の列名の金種（例: ATM現金（手入力以外）入金（1000円）枚数 → 1000）"""
+    return col.split('（')[2].split('円')[0]
+
+
+def branch_entry(atm_df):
+    """支店のATM精算データと金種の列・集計キューブをまとめた辞書"""
+    bill_cols = denomination_columns(atm_df.columns, BILL_VALUES)
+    coin_cols = denomination_columns(atm_df.columns, COIN_VALUES)
+    return {
+        'atm_df': atm_df,
+        'bill_cols': bill_cols,
+        'coin_cols': coin_cols,
+        'cube': branch_cube(atm_df, bill_cols + coin_cols)
+    }
+
+
+def atm_months(data):
+    """支店のATM精算データがある月の一覧"""
+    return date_partitions(data['atm_df']).months
+
+
+# デモデータ（合成データ）の期間・1日あたりの取引件数・乱数のシード
+DEMO_START = '2023-11-01'
+DEMO_DAYS = 92
+DEMO_TRANSACTIONS_PER_DAY = 50
+DEMO_SEED = 0
+
+_DEMO_LOCK = threading.Lock()
+_DEMO_BRANCHES = {}
+
+
+def demo_branch(code):
+    """支店のデモデータ（branch_entryの辞書と現金フローデータの組）
+
+    実データと同じ形式の合成データを読み込み時と同じ変換に通す。再実行の
+    たびに作り直すと日次フローのビューや集計キューブが別のデータとして
+    扱われるため、支店ごとに一度だけ作成して同じデータフレームを返す。
+    """
+    with _DEMO_LOCK:
+        if code not in _DEMO_BRANCHES:
+            frames = branch_frames(code, DEMO_START, DEMO_DAYS, DEMO_TRANSACTIONS_PER_DAY, DEMO_SEED)
+            frames['atm_settlement'] = frames['atm'].copy()
+            _DEMO_BRANCHES[code] = (
+                branch_entry(process_atm_frame(frames['atm'])),
+                {key: process_cash_flow_frame(frames[key], key) for key in CASH_FLOW_FILE_KINDS}
+            )
+        return _DEMO_BRANCHES[code]
+
+
+# 概要
+
+def overview_summary(cube, month):
+    """月の取引件数・平均在高金額・最大在高金額"""
+    return {
+        '取引件数': cube.row_count(month),
+        '平均在高金額': cube.mean(month, BALANCE_COL),
+        '最大在高金額': cube.max(month, BALANCE_COL)
+    }
+
+
+def hourly_deposits(cube, month):
+    """時間帯別のATM現金入金取引数（入金額が0より大きい取引）"""
+    return cube.hourly_sum(month, DEPOSIT_COUNT_COL)
+
+
+def hourly_deposits_chart(hourly, title=None):
+    return ChartSpec(
+        'bar', hourly, title=title, xlabel='時間帯', ylabel='ATM現金入金取引数（件）',
+        # X軸の目盛りを設定（0-23時）
+        xticks=list(range(24)), xticklabels=[f'{h}時' for h in range(24)], rotate=45, grid='y'
+    )
+
+
+def daily_balance(cube, month):
+    """日別の平均在高金額（百万円単位、日付と曜日のラベル）"""
+    balance = cube.daily_mean(month, BALANCE_COL) / 1_000_000
+    balance.index = cube.date_labels(balance.index)
+    return balance
+
+
+def daily_balance_chart(balance, title=None):
+    return ChartSpec('line', balance.to_frame('在高合計金額'), title=title, xlabel='日付',
+                     ylabel='在高金額（百万円）', yformat='comma', rotate=45, grid=True)
+
+
+# 金種別分析
+
+def money_type_columns(data, money_type):
+    """金種タイプ（紙幣・硬貨）の列と{列: 表示名}"""
+    _, suffix = MONEY_TYPES[money_type]
+    cols = data['bill_cols'] if money_type == '紙幣' else data['coin_cols']
+    return cols, {col: f'{column_denomination(col)}{suffix}' for col in cols}
+
+
+def daily_denomination_means(cube, month, cols, labels):
+    """金種ごとの日別平均入金枚数（列が金種、行が日付と曜日のラベル）"""
+    values = pd.DataFrame({labels[col]: cube.daily_mean(month, col) for col in cols})
+    values.index = cube.date_labels(values.index)
+    return values
+
+
+def denomination_trend_chart(values, title=None):
+    return ChartSpec('line', values, title=title, xlabel='日付', ylabel='枚数', size=(12, 6), rotate=45, grid=True)
+
+
+def denomination_summary(cube, month, cols, labels):
+    """金種ごとの月間入金枚数・平均枚数・ピーク時間帯"""
+    rows = []
+    for col in cols:
+        hourly = cube.hourly_sum(month, col)
+        rows.append({
+            '金種': labels[col],
+            '月間入金枚数': int(hourly.sum()),
+            '平均枚数': cube.mean(month, col),
+            'ピーク時間帯': f'{hourly.idxmax()}時' if hourly.sum() > 0 else '-'
+        })
+    return pd.DataFrame(rows, columns=['金種', '月間入金枚数', '平均枚数', 'ピーク時間帯'])
+
+
+def hourly_heatmap(cube, month, col):
+    """時間帯×日付の平均入金枚数（行が時間帯、列が日付と曜日のラベル）"""
+    pivot = cube.hour_date_mean(month, col).round(1)
+    pivot.columns = cube.date_labels(pivot.columns)
+    return pivot
+
+
+def hourly_heatmap_chart(pivot, label):
+    return ChartSpec('heatmap', pivot, title=f'{label}の時間帯別平均取扱枚数', xlabel='日付', ylabel='時間帯',
+                     size=(15, 8), colorbar_label='平均枚数')
+
+
+# 支店間比較
+
+def comparison_table(branch_data, month):
+    """月のデータがある支店の取引件数と平均在高金額（百万円）"""
+    rows = [
+        {
+            '支店コード': code,
+            '取引件数': data['cube'].row_count(month),
+            '平均在高金額（百万円）': data['cube'].mean(month, BALANCE_COL) / 1_000_000
+        }
+        for code, data in branch_data.items() if data['cube'].row_count(month) > 0
+    ]
+    return pd.DataFrame(rows, columns=['支店コード', '取引件数', '平均在高金額（百万円）']).set_index('支店コード')
+
+
+def transactions_chart(counts, title=None):
+    # 取引件数の多い支店ほど濃い青で表示
+    return ChartSpec('bar', counts, title=title, xlabel='支店コード', ylabel='取引件数', shade='Blues', rotate=45)
+
+
+def balances_chart(balances, title=None):
+    # 平均在高金額の多い支店ほど濃い緑で表示（Y軸はカンマ区切りの整数）
+    return ChartSpec('bar', balances, title=title, xlabel='支店コード', ylabel='平均在高金額（百万円）',
+                     shade='Greens', yformat='comma', rotate=45)
+
+
+def flow_comparison(flows, month):
+    """支店・金種ごとの⑤合計の月合計（行が支店、列が金種の表示名）"""
+    month_flows = date_partitions(flows).month(flows, month)
+    if month_flows.empty:
+        return pd.DataFrame(columns=list(DENOMINATION_LABELS.values()))
+    totals = month_flows.pivot_table(
+        index='branch', columns='denomination', values=FLOW_TOTAL, aggfunc='sum', observed=True
+    ).reindex(columns=list(DENOMINATION_LABELS))
+    totals.columns = [DENOMINATION_LABELS[value] for value in totals.columns]
+    totals.index = totals.index.astype(str)
+    totals.index.name = '支店コード'
+    return totals
+
+
+# 現金フロー分析
+
+def month_bounds(month):
+    """月の開始日と終了日"""
+    month = pd.Period(month, freq='M')
+    return month.start_time, month.end_time.normalize()
+
+
+def flow_months(flows, code):
+    """支店の現金フローがある月の一覧"""
+    selected = branch_flows(flows, code)
+    if selected.empty:
+        return []
+    return list(pd.period_range(selected['日付'].min(), selected['日付'].max(), freq='M'))
+
+
+def month_cash_flows(flows, forecasts, code, month, methods):
+    """支店の月の日次フローと、予測方法ごとの⑤合計の予測値
+
+    戻り値は(日次フロー, {予測方法: 予測表の行})。
+    """
+    start, end = month_bounds(month)
+    selected = branch_flows(flows, code)
+    month_flows = selected[selected['日付'].between(start, end)]
+    month_forecasts = {}
+    for method in methods:
+        rows = forecast_slice(forecasts, code, method)
+        month_forecasts[method] = rows[rows['日付'].between(start, end)]
+    return month_flows, month_forecasts
+
+
+def cash_flow_summary(month_flows, month_forecasts, values):
+    """金種ごとの月間の実績合計・予測合計・平均絶対誤差"""
+    actual = month_flows.groupby('denomination', observed=True)[FLOW_TOTAL].sum()
+    predicted = month_forecasts.groupby('denomination', observed=True)['予測値'].sum()
+    abs_error = (
+        month_flows.set_index(['denomination', '日付'])[FLOW_TOTAL]
+        - month_forecasts.set_index(['denomination', '日付'])['予測値']
+    ).abs().groupby(level='denomination').mean()
+    return pd.DataFrame({
+        '金種': [DENOMINATION_LABELS[value] for value in values],
+        '実績合計': actual.reindex(values).fillna(0).values,
+        '予測合計': predicted.reindex(values).values,
+        '平均絶対誤差': abs_error.reindex(values).values
+    })
+
+
+def denomination_flow_frame(month_flows, month_forecasts, value, month):
+    """金種の日次フロー（取引のない日は0）と予測方法ごとの予測値の列
+
+    予測値の列名は「予測値（予測方法）」。
+    """
+    start, end = month_bounds(month)
+    frame = pd.DataFrame(index=pd.date_range(start, end, name='日付'))
+    frame = frame.join(
+        month_flows[month_flows['denomination'] == value].set_index('日付')[FLOW_SERIES]
+    ).fillna(0)
+    for method, forecasts in month_forecasts.items():
+        frame[forecast_column(method)] = forecasts[forecasts['denomination'] == value].set_index('日付')['予測値']
+    return frame
+
+
+def forecast_column(method):
+    return f'予測値（{method}）'
+
+
+def day_labels(frame):
+    return frame.index.strftime('%m/%d(%a)')
+
+
+def flows_chart(frame, title):
+    return ChartSpec('line', frame[FLOW_SERIES].set_index(day_labels(frame)), title=title, xlabel='日付',
+                     ylabel='枚数', size=(15, 6), grid=True, rotate=45)
+
+
+def forecast_chart(frame, methods, title):
+    """⑤合計の実績値と予測方法ごとの予測値（予測値は破線）"""
+    cols = [forecast_column(method) for method in methods]
+    data = frame[[FLOW_TOTAL] + cols].rename(columns={FLOW_TOTAL: '実績値'}).set_index(day_labels(frame))
+    return ChartSpec('line', data, title=title, xlabel='日付', ylabel='枚数', size=(15, 6), grid=True, rotate=45,
+                     styles={col: {'linestyle': '--', 'marker': None} for col in cols})
@@ -0,0 +1,179 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CASH_FLOW_FILE_KINDS, CASH_FLOW_PREFIXES, DENOMINATION_VALUES, PAYDAY
+from tracing import configure_logging
+
+# 金種ごとの1取引あたりの平均入金枚数（紙幣は少なく、100円・500円玉は多い）
+DEPOSIT_MEANS = {
+    '10000': 1.5, '5000': 0.8, '2000': 0.1, '1000': 2.5,
+    '500': 3.0, '100': 5.0, '50': 1.5, '10': 4.0, '5': 1.0, '1': 2.5
+}
+
+# 時間帯（0-23時）ごとの取引の起こりやすさ（昼と夕方に山がある営業時間の分布）
+HOUR_WEIGHTS = np.array([
+    0, 0, 0, 0, 0, 0, 0, 1,
+    3, 5, 6, 7, 9, 8, 6, 6,
+    7, 8, 9, 8, 6, 4, 2, 0
+], dtype=float)
+
+# 曜日（月曜が0）ごとの取引量の倍率と、7の日・給与日・月末の倍率
+WEEKDAY_FACTORS = np.array([0.9, 0.95, 1.0, 1.0, 1.15, 1.3, 1.2])
+SEVENTH_DAY_FACTOR = 1.2
+PAYDAY_FACTOR = 1.4
+MONTH_END_FACTOR = 1.25
+
+# 現金フローの種類ごとの1日あたりの平均枚数（金種の平均入金枚数×1日の取引件数/100に対する倍率）
+# ATM精算（入金のある取引が6割）はおよそ60にあたるため、①補充＋③両替と②預入＋④精算が釣り合う値にする
+CASH_FLOW_SCALES = {'pos_withdrawal': 50.0, 'bank_deposit': 20.0, 'bank_exchange': 30.0}
+
+# ファイルごとの文字コード（実データと同じくshift-jis系を基本とし、BOM付きUTF-8も混在させる）
+FILE_ENCODINGS = {
+    'atm': 'cp932',
+    'pos_withdrawal': 'cp932',
+    'bank_deposit': 'cp932',
+    'bank_exchange': 'utf-8-sig'
+}
+
+
+def branch_codes(n):
+    """n支店分の支店コード（5桁）"""
+    return [f'{500 + i:05d}' for i in range(n)]
+
+
+def _activity(dates):
+    # 日ごとの取引量の倍率（曜日・特異日）
+    factor = WEEKDAY_FACTORS[dates.dayofweek]
+    factor = factor * np.where(dates.day % 10 == 7, SEVENTH_DAY_FACTOR, 1.0)
+    factor = factor * np.where(dates.day == PAYDAY, PAYDAY_FACTOR, 1.0)
+    return factor * np.where(dates.is_month_end, MONTH_END_FACTOR, 1.0)
+
+
+def settlement_frame(rng, dates, transactions_per_day):
+    """ATM精算データ（1行が1取引）をCSVと同じ列・形式で作る
+
+    取引件数は日ごとの倍率を掛けたポアソン分布、時刻は営業時間の分布から
+    まとめて抽選し、在高は日ごとに入金の累積で増える（翌日に回収される）。
+    """
+    counts = rng.poisson(transactions_per_day * _activity(dates))
+    n = int(counts.sum())
+    day_index = np.repeat(np.arange(len(dates)), counts)
+
+    hours = rng.choice(24, size=n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = hours * 3600 + rng.integers(0, 3600, n)
+    order = np.lexsort((seconds, day_index))
+    day_index, seconds = day_index[order], seconds[order]
+
+    ymd = (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy()
+    df = pd.DataFrame({
+        '日付': ymd[day_index],
+        '時刻': seconds // 3600 * 10000 + seconds % 3600 // 60 * 100 + seconds % 60
+    })
+
+    # 6割程度の取引で入金がある（それ以外は出金・照会などで入金枚数は0）
+    has_deposit = rng.random(n) < 0.6
+    deposits = {
+        value: rng.poisson(DEPOSIT_MEANS[value], n) * has_deposit
+        for value in DENOMINATION_VALUES
+    }
+    amount = sum(deposits[value] * int(value) for value in DENOMINATION_VALUES)
+
+    # 日ごとの累積（日の最初の取引の直前までの累積を引く）
+    day_starts = np.r_[0, np.cumsum(np.bincount(day_index, minlength=len(dates)))[:-1]]
+
+    def daily_cumsum(values):
+        total = np.cumsum(values)
+        before = np.r_[0, total][day_starts]
+        return total - before[day_index]
+
+    opening = rng.integers(2_000_000, 4_000_000)
+    df['在高合計金額'] = opening + daily_cumsum(amount)
+    df['ATM現金入金計金額'] = amount
+    for value in DENOMINATION_VALUES:
+        df[f'ATM現金（手入力以外）入金（{value}円）枚数'] = deposits[value]
+    for value in DENOMINATION_VALUES:
+        df[f'在高（{value}円）枚数'] = rng.integers(50, 500) + daily_cumsum(deposits[value])
+    return df
+
+
+def cash_flow_frame(rng, dates, key, transactions_per_day):
+    """現金フローデータ（1行が1日）をCSVと同じ列・形式で作る"""
+    prefix = CASH_FLOW_PREFIXES[key][:-2]  # 出金枚数→出金
+    activity = _activity(dates) * transactions_per_day / 100
+    ymd = (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy()
+    df = pd.DataFrame({'日付': ymd})
+    for value in DENOMINATION_VALUES:
+        counts = rng.poisson(DEPOSIT_MEANS[value] * CASH_FLOW_SCALES[key] * activity)
+        df[f'{prefix}枚数（{value}円）'] = counts
+        df[f'{prefix}金額（{value}円）'] = counts * int(value)
+    return df
+
+
+def branch_frames(code, start='2023-11-01', days=92, transactions_per_day=200, seed=0):
+    """1支店分のATM精算データと3種類の現金フローデータ（CSVと同じ形式）
+
+    乱数は(seed, 支店コード)から作るため、支店ごとに再現可能で、
+    支店の数や生成の順序を変えても同じ支店は同じデータになる。
+    """
+    rng = np.random.default_rng([seed, int(code)])
+    dates = pd.date_range(start, periods=days)
+    frames = {'atm': settlement_frame(rng, dates, transactions_per_day)}
+    for key in CASH_FLOW_SCALES:
+        frames[key] = cash_flow_frame(rng, dates, key, transactions_per_day)
+    return frames
+
+
+def write_csv(df, path, encoding):
+    """CSVを書き出す（ヘッダーは指定の文字コード、本体は数字だけのためそのまま書く）
+
+    pyarrowが利用できれば本体をマルチスレッドで書き出す。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        df.to_csv(path, index=False, encoding=encoding)
+        return
+
+    with open(path, 'wb') as f:
+        f.write((','.join(df.columns) + '\n').encode(encoding))
+        pa_csv.write_csv(
+            pa.Table.from_pandas(df, preserve_index=False), f,
+            pa_csv.WriteOptions(include_header=False, quoting_style='none')
+        )
+
+
+def write_dataset(out_dir, branches=3, start='2023-11-01', days=92, transactions_per_day=200, seed=0):
+    """{支店コード}_{種別}.csvの規則で合成データを書き出し、書き出した行数を返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = 0
+    for code in branch_codes(branches):
+        for key, df in branch_frames(code, start, days, transactions_per_day, seed).items():
+            data_type = CASH_FLOW_FILE_KINDS['atm_settlement' if key == 'atm' else key]
+            write_csv(df, os.path.join(out_dir, f'{code}_{data_type}.csv'), FILE_ENCODINGS[key])
+            rows += len(df)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='負荷試験用の合成データ（ATM精算・現金フローのCSV）を作成します')
+    parser.add_argument('out_dir', help='出力先ディレクトリ')
+    parser.add_argument('--branches', type=int, default=3, help='支店数（既定: 3）')
+    parser.add_argument('--start', default='2023-11-01', help='開始日（既定: 2023-11-01）')
+    parser.add_argument('--days', type=int, default=92, help='日数（既定: 92）')
+    parser.add_argument('--per-day', type=int, default=200, help='1支店・1日あたりの平均取引件数（既定: 200）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数のシード（既定: 0）')
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    started = time.perf_counter()
+    rows = write_dataset(args.out_dir, args.branches, args.start, args.days, args.per_day, args.seed)
+    print(f"合成データを作成しました: {args.out_dir}（{rows:,}行, {time.perf_counter() - started:.1f}秒）")
+
+
+if __name__ == '__main__':
+    main()
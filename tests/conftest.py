@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+# テストはリポジトリ直下のモジュールをそのままimportする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import CASH_FLOW_FILE_KINDS  # noqa: E402
+from synthetic_data import branch_codes, write_dataset  # noqa: E402
+
+
+def _write(path, data, mtime_ns):
+    # 同じ秒の書き込みでもフィンガープリントが変わるよう更新時刻を指定する
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def write_file():
+    """write_file(パス, バイト列, 更新時刻ns)でファイルを書き込む"""
+    return _write
+
+
+@pytest.fixture
+def cut_dataset(tmp_path):
+    """合成データを書き出し、各ファイルを行の途中まで切り詰める
+
+    cut_dataset(branches, days, transactions_per_day)は
+    {(支店コード, データの種類): (パス, 元の内容)}を返す。
+    """
+    def make(branches, days, transactions_per_day):
+        write_dataset(str(tmp_path), branches=branches, days=days, transactions_per_day=transactions_per_day)
+        files = {}
+        for code in branch_codes(branches):
+            for key, data_type in CASH_FLOW_FILE_KINDS.items():
+                path = str(tmp_path / f'{code}_{data_type}.csv')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                lines = data.splitlines(keepends=True)
+                _write(path, b''.join(lines[:len(lines) // 2]), 1_000_000_000)
+                files[(code, key)] = (path, data)
+        return files
+    return make
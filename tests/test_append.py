@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+
+from data_loader import DatasetCache
+
+
+def _full_load(tmp_path, data):
+    # 追記読み込みと比べるため、同じ内容を別のファイルとして全体から解析する
+    path = tmp_path / 'full' / 'reference.csv'
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(data)
+    return DatasetCache(use_sidecar=False).get_or_load(str(path), 'atm')
+
+
+@pytest.fixture
+def settlement(cut_dataset):
+    """合成データのATM精算ファイルを(パス, 全体のバイト列, 行の区切り位置)で返す"""
+    path, data = cut_dataset(branches=1, days=20, transactions_per_day=30)[('00500', 'atm_settlement')]
+    ends = [i + 1 for i, b in enumerate(data) if b == ord('\n')]
+    return path, data, ends
+
+
+def test_append_matches_full_reload(tmp_path, settlement, write_file):
+    path, data, ends = settlement
+    cache = DatasetCache()
+    first = ends[len(ends) // 2]
+    write_file(path, data[:first], 1_000_000_000)
+    cache.get_or_load(path, 'atm')
+
+    write_file(path, data, 2_000_000_000)
+    appended = cache.get_or_load(path, 'atm')
+    assert cache.stats()['appends'] == 1
+    pd.testing.assert_frame_equal(appended, _full_load(tmp_path, data))
+
+
+def test_partial_last_line_is_deferred(tmp_path, settlement, write_file):
+    path, data, ends = settlement
+    cache = DatasetCache()
+    first, second = ends[len(ends) // 3], ends[2 * len(ends) // 3]
+    write_file(path, data[:first], 1_000_000_000)
+    cache.get_or_load(path, 'atm')
+
+    # 書き込み途中の行は読まずに、改行までの行だけを追記する
+    partial = second + 10
+    write_file(path, data[:partial], 2_000_000_000)
+    pd.testing.assert_frame_equal(cache.get_or_load(path, 'atm'), _full_load(tmp_path, data[:second]))
+
+    write_file(path, data, 3_000_000_000)
+    pd.testing.assert_frame_equal(cache.get_or_load(path, 'atm'), _full_load(tmp_path, data))
+    assert cache.stats()['appends'] == 2
+
+
+def test_append_after_restart_from_sidecar(tmp_path, settlement, write_file):
+    path, data, ends = settlement
+    first = ends[len(ends) // 2]
+    write_file(path, data[:first], 1_000_000_000)
+    DatasetCache().get_or_load(path, 'atm')
+
+    # 再起動後（メモリ上のキャッシュなし）はサイドカーの状態から追記分を読む
+    write_file(path, data, 2_000_000_000)
+    cache = DatasetCache()
+    appended = cache.get_or_load(path, 'atm')
+    assert cache.stats()['appends'] == 1
+    assert cache.stats()['misses'] == 0
+    pd.testing.assert_frame_equal(appended, _full_load(tmp_path, data))
+
+    restarted = DatasetCache()
+    pd.testing.assert_frame_equal(restarted.get_or_load(path, 'atm'), appended)
+    assert restarted.stats()['sidecar_hits'] == 1
+
+
+def test_rewrite_falls_back_to_full_reload(tmp_path, settlement, write_file):
+    path, data, ends = settlement
+    cache = DatasetCache()
+    first = ends[len(ends) // 2]
+    write_file(path, data[:first], 1_000_000_000)
+    cache.get_or_load(path, 'atm')
+
+    # 既存の行（ヘッダーの次の行）の数字を書き換えてから行を追記する
+    row = data[ends[0]:ends[1]]
+    changed = row.replace(b',', b',9', 1)
+    rewritten = data[:ends[0]] + changed + data[ends[1]:]
+    write_file(path, rewritten, 2_000_000_000)
+    reloaded = cache.get_or_load(path, 'atm')
+    assert cache.stats()['appends'] == 0
+    assert cache.stats()['misses'] == 2
+    pd.testing.assert_frame_equal(reloaded, _full_load(tmp_path, rewritten))
+
+
+def test_mid_file_edit_falls_back_to_full_reload(tmp_path, settlement, write_file):
+    path, data, ends = settlement
+    cache = DatasetCache()
+    first = ends[len(ends) // 2]
+    write_file(path, data[:first], 1_000_000_000)
+    cache.get_or_load(path, 'atm')
+
+    # 読み込み済み範囲の中ほどの行の最後の数字を同じ桁数で書き換えてから行を追記する
+    row = len(ends) // 4
+    end = ends[row] - 1
+    while not chr(data[end - 1]).isdigit():
+        end -= 1
+    digit = b'1' if data[end - 1:end] != b'1' else b'2'
+    rewritten = data[:end - 1] + digit + data[end:]
+    assert len(rewritten) == len(data)
+    write_file(path, rewritten, 2_000_000_000)
+    reloaded = cache.get_or_load(path, 'atm')
+    assert cache.stats()['appends'] == 0
+    pd.testing.assert_frame_equal(reloaded, _full_load(tmp_path, rewritten))
+
+    # サイドカーにも書き換え後の内容が保存される
+    pd.testing.assert_frame_equal(DatasetCache().get_or_load(path, 'atm'), reloaded)
@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+from data_loader import CASH_FLOW_FILE_KINDS, DatasetCache
+from data_views import FLOW_SOURCES, DailyFlowView
+from synthetic_data import write_dataset
+
+
+@pytest.fixture
+def dataset(cut_dataset):
+    """合成データの各ファイルを行の途中まで切り詰め、元の内容と一緒に返す"""
+    return cut_dataset(branches=2, days=40, transactions_per_day=20)
+
+
+def _load(cache, files):
+    data = {}
+    for (code, key), (path, _) in files.items():
+        data.setdefault(code, {})[key] = cache.get_or_load(path, key)
+    return data
+
+
+def test_append_updates_incrementally(dataset, write_file):
+    cache = DatasetCache(use_sidecar=False)
+    view = DailyFlowView(cache)
+    view.update(_load(cache, dataset))
+    assert view.rebuilds == 2
+
+    # 1支店のファイルに行を追記すると、その支店だけを追記分から集計する
+    for (code, key), (path, data) in dataset.items():
+        if code == '00500':
+            write_file(path, data, 2_000_000_000)
+    data = _load(cache, dataset)
+    table = view.update(data)
+    assert cache.stats()['appends'] == len(CASH_FLOW_FILE_KINDS)
+    assert view.increments == 1
+    assert view.rebuilds == 2
+    pd.testing.assert_frame_equal(table, DailyFlowView(cache).update(data))
+
+
+def test_unchanged_data_keeps_version(dataset):
+    cache = DatasetCache(use_sidecar=False)
+    view = DailyFlowView(cache)
+    data = _load(cache, dataset)
+    table = view.update(data)
+    version = view.version
+    assert view.update(_load(cache, dataset)) is table
+    assert view.version == version
+
+
+def test_rewrite_rebuilds_branch(dataset, write_file):
+    cache = DatasetCache(use_sidecar=False)
+    view = DailyFlowView(cache)
+    view.update(_load(cache, dataset))
+
+    # 追記以外の変更（先頭の行の削除）は支店を作り直す
+    path, data = dataset[('00501', 'pos_withdrawal')]
+    lines = data.splitlines(keepends=True)
+    write_file(path, lines[0] + b''.join(lines[2:]), 2_000_000_000)
+    data = _load(cache, dataset)
+    table = view.update(data)
+    assert view.increments == 0
+    assert view.rebuilds == 3
+    pd.testing.assert_frame_equal(table, DailyFlowView(cache).update(data))
+
+
+def test_removed_branch_is_dropped(dataset):
+    cache = DatasetCache(use_sidecar=False)
+    view = DailyFlowView(cache)
+    data = _load(cache, dataset)
+    view.update(data)
+
+    del data['00501']
+    table = view.update(data)
+    assert table['branch'].unique().tolist() == ['00500']
+    pd.testing.assert_frame_equal(table, DailyFlowView(cache).update(data))
+
+
+def test_synthetic_flows_are_on_the_same_scale(tmp_path):
+    # 合成データの④精算（ATMへの入金枚数）は①〜③と同じ程度の枚数で、⑤合計は0の前後になる
+    write_dataset(str(tmp_path), branches=1, days=30, transactions_per_day=50)
+    cache = DatasetCache(use_sidecar=False)
+    data = {'00500': {
+        key: cache.get_or_load(str(tmp_path / f'00500_{data_type}.csv'), key)
+        for key, data_type in CASH_FLOW_FILE_KINDS.items()
+    }}
+    means = DailyFlowView(cache).update(data).groupby('denomination', observed=True).mean(numeric_only=True)
+    sources = means[['①補充', '②預入', '③両替', '④精算']]
+    assert (sources.max(axis=1) <= 5 * sources.min(axis=1)).all()
+    assert (means['⑤合計'].abs() <= sources.max(axis=1)).all()
+
+
+def test_ledger_matches_flows_after_append(dataset, write_file):
+    cache = DatasetCache(use_sidecar=False)
+    view = DailyFlowView(cache)
+    view.update(_load(cache, dataset))
+    for (code, key), (path, data) in dataset.items():
+        if code == '00500':
+            write_file(path, data, 2_000_000_000)
+    table = view.update(_load(cache, dataset))
+    assert view.increments == 1
+
+    # 共有の台帳は追記分を含み、集計すると日次フロー表と一致する
+    ledger = view.ledger
+    assert view.ledger is ledger
+    assert ledger['branch'].cat.categories.tolist() == ['00500', '00501']
+    sums = ledger.groupby(['branch', 'denomination', 'source'], observed=True)['count'].sum()
+    expected = table.melt(id_vars=['branch', 'denomination'], value_vars=list(FLOW_SOURCES.values()),
+                          var_name='source', value_name='count') \
+        .groupby(['branch', 'denomination', 'source'], observed=True)['count'].sum()
+    assert _counts(sums) == _counts(expected[expected != 0])
+
+
+def _counts(series):
+    return {tuple(map(str, key)): int(value) for key, value in series.items()}
@@ -0,0 +1,44 @@
+import gc
+import weakref
+
+import pandas as pd
+
+import data_views
+from data_views import date_partitions, derived
+
+
+def _frame():
+    return pd.DataFrame({
+        '日付': pd.to_datetime(['2023-11-02', '2023-11-01', '2023-12-01', '2023-11-03']),
+        'value': [1, 2, 3, 4]
+    })
+
+
+def test_partitions_slice_unsorted_frame():
+    df = _frame()
+    partitions = date_partitions(df)
+    assert partitions.months == [pd.Period('2023-11', 'M'), pd.Period('2023-12', 'M')]
+    assert partitions.month(df, '2023-11')['value'].tolist() == [1, 2, 4]
+    assert partitions.range(df, '2023-11-02', '2023-12-01')['value'].tolist() == [1, 3, 4]
+
+
+def test_derived_entry_released_with_frame():
+    df = _frame()
+    date_partitions(df)
+    key = ((id(df),), 'partitions:日付')
+    assert key in data_views._derived
+
+    ref = weakref.ref(df)
+    del df
+    gc.collect()
+    assert ref() is None
+    assert key not in data_views._derived
+
+
+def test_derived_discard_while_lock_held():
+    # ロックを保持している最中に元のデータフレームが解放されても止まらない
+    df = _frame()
+    derived(df, 'test', lambda d: len(d))
+    with data_views._derived_lock:
+        del df
+        gc.collect()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_views import FLOW_TOTAL
+from forecast import (FLOW_SERIES, METHOD_SAME_CLASS, CashFlowForecaster, _backtest_errors, day_class,
+                      forecast_table, rolling_origins, same_class_mean_forecast)
+
+
+def _loop_forecast(actual):
+    # 以前の日ごとのループ（その日より前の同じ分類の日の平均、なければ実績値）
+    dates = actual.index
+    seventh = dates.day % 10 == 7
+    forecast = []
+    for i, date in enumerate(dates):
+        if seventh[i]:
+            prior = actual[seventh & (dates < date)]
+        else:
+            prior = actual[~seventh & (dates.dayofweek == date.dayofweek) & (dates < date)]
+        forecast.append(prior.mean() if len(prior) else actual.iloc[i])
+    return pd.Series(forecast, index=dates)
+
+
+def _flows(days=120, seed=0):
+    """2支店・2金種の日次フロー表（⑤合計は①〜④から求める）"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2023-10-01', periods=days)
+    frames = []
+    for branch in ['00500', '00501']:
+        for denomination in ['100', '1000']:
+            frame = pd.DataFrame({'branch': branch, 'denomination': denomination, '日付': dates})
+            for col in FLOW_SERIES[:-1]:
+                frame[col] = rng.poisson(20, days)
+            frame[FLOW_TOTAL] = frame['①補充'] - frame['②預入'] + frame['③両替'] - frame['④精算']
+            frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_same_class_mean_matches_loop():
+    actual = pd.Series(np.random.default_rng(1).normal(0, 50, 150),
+                       index=pd.date_range('2023-11-01', periods=150))
+    pd.testing.assert_series_equal(same_class_mean_forecast(actual), _loop_forecast(actual))
+
+
+def test_forecast_table_same_class_matches_loop():
+    flows = _flows()
+    forecasts = forecast_table(flows)
+    for (branch, denomination), rows in flows.groupby(['branch', 'denomination']):
+        expected = _loop_forecast(rows.set_index('日付')[FLOW_TOTAL].astype(float))
+        predicted = forecasts[
+            (forecasts['branch'] == branch) & (forecasts['denomination'] == denomination)
+            & (forecasts['series'] == FLOW_TOTAL) & (forecasts['method'] == METHOD_SAME_CLASS)
+        ].set_index('日付')['予測値']
+        np.testing.assert_allclose(predicted.to_numpy(), expected.to_numpy())
+        assert predicted.index.equals(expected.index)
+
+
+def _history(days=500, n_series=3, seed=2):
+    """季節調整まで効く長さの系列×日の配列と日付"""
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 30, (n_series, days)), pd.date_range('2022-01-01', periods=days)
+
+
+def _changed_from(values, position, seed=3):
+    # 指定した位置以降の値だけを別の値に置き換える
+    changed = values.copy()
+    changed[:, position:] = np.random.default_rng(seed).normal(100, 80, changed[:, position:].shape)
+    return changed
+
+
+def test_one_step_does_not_look_ahead():
+    values, dates = _history()
+    base = CashFlowForecaster(values, dates).one_step()
+    for t in [1, 40, 200, 400, 499]:
+        changed = CashFlowForecaster(_changed_from(values, t), dates).one_step()
+        np.testing.assert_array_equal(changed[:, t], base[:, t])
+        np.testing.assert_array_equal(changed[:, :t], base[:, :t])
+
+
+def test_predict_does_not_look_ahead():
+    values, dates = _history()
+    origins = np.array([60, 200, 380, 450])
+    targets = origins + np.array([0, 6, 3, 30])
+    base = CashFlowForecaster(values, dates).predict(origins, targets)
+    for i, origin in enumerate(origins):
+        # 起点の日以降の値を変えても、その起点からの予測は変わらない
+        changed = CashFlowForecaster(_changed_from(values, origin), dates).predict(origins, targets)
+        np.testing.assert_array_equal(changed[:, i], base[:, i])
+
+
+def test_rolling_origins_layout():
+    origins, targets, horizons = rolling_origins(100, horizons=(1, 7), step=7, min_history=60)
+    # 1日先は起点の日そのもの、7日先は起点から6日後で、履歴の外に出る対象日は除く
+    assert origins.tolist() == [60, 67, 74, 81, 88, 95] + [60, 67, 74, 81, 88]
+    assert targets.tolist() == [60, 67, 74, 81, 88, 95] + [66, 73, 80, 87, 94]
+    assert horizons.tolist() == [1] * 6 + [7] * 5
+
+
+def test_backtest_mape_skips_zero_actuals():
+    rng = np.random.default_rng(4)
+    dates = pd.date_range('2023-01-01', periods=120)
+    values = rng.poisson(20, (1, 120)).astype(float)
+    origins, targets, _ = rolling_origins(120, horizons=(1,), step=7, min_history=60)
+    values[0, targets[::2]] = 0
+    keys = pd.MultiIndex.from_tuples([('00500', '100', FLOW_TOTAL)], names=['branch', 'denomination', 'series'])
+
+    result = _backtest_errors(values, dates, keys, (1,), 7, 60)
+    row = result[result['method'] == METHOD_SAME_CLASS].iloc[0]
+
+    # 同じ分類の起点より前の日の平均を予測値とし、実績0の日はMAPEの計算から除く
+    classes = day_class(dates)
+    predicted = np.array([values[0, :o][classes[:o] == classes[t]].mean() for o, t in zip(origins, targets)])
+    actual = values[0, targets]
+    nonzero = actual != 0
+    assert row['件数'] == len(targets)
+    assert row['MAE'] == pytest.approx(np.abs(predicted - actual).mean())
+    assert row['MAPE'] == pytest.approx(
+        (np.abs(predicted - actual)[nonzero] / actual[nonzero]).mean() * 100)
+    assert np.isfinite(result['MAPE']).all()
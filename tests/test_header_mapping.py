@@ -0,0 +1,41 @@
+import logging
+
+import pandas as pd
+
+from data_loader import HeaderMapping, header_mapping, process_cash_flow_frame
+
+
+def test_settlement_uses_deposit_counts_not_stock():
+    # 在高（N円）枚数が後ろにあっても、精算枚数はATMへの入金枚数の列から取る
+    columns = ['日付', 'ATM現金（手入力以外）入金（100円）枚数', '在高（100円）枚数']
+    df = pd.DataFrame([[20231101, 3, 9000]], columns=columns)
+    df = process_cash_flow_frame(df, 'atm_settlement')
+    assert df['精算枚数_100円'].tolist() == [3]
+    assert '在高（100円）枚数' in df.columns
+    assert HeaderMapping(columns, 'atm_settlement').duplicates == {}
+
+
+def test_denomination_is_matched_exactly():
+    # 「1」が「10000」や「10」に部分一致しない
+    columns = ['出金枚数（10000円）', '出金枚数（10円）', '出金枚数 （1円）', '出金金額（1円）']
+    mapping = HeaderMapping(columns, 'pos_withdrawal')
+    assert mapping.renames == {
+        '出金枚数（10000円）': '出金枚数_10000円',
+        '出金枚数（10円）': '出金枚数_10円',
+        '出金枚数 （1円）': '出金枚数_1円'
+    }
+    assert HeaderMapping(['出金枚数（3円）'], 'pos_withdrawal').unmapped == ['出金枚数（3円）']
+
+
+def test_other_kinds_columns_are_ignored():
+    # 別の種類の枚数の列は対応付けない
+    mapping = HeaderMapping(['預入枚数（500円）', '出金枚数（500円）'], 'bank_deposit')
+    assert mapping.renames == {'預入枚数（500円）': '預入枚数_500円'}
+
+
+def test_duplicates_are_logged_as_warning(caplog):
+    columns = ['両替枚数（50円）', '両替枚数 （50円）']
+    with caplog.at_level(logging.WARNING):
+        mapping = header_mapping(columns, 'bank_exchange')
+    assert mapping.renames == {'両替枚数 （50円）': '両替枚数_50円'}
+    assert any('両替枚数_50円' in record.getMessage() for record in caplog.records)
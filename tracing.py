@@ -0,0 +1,107 @@
+import contextvars
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+# ログの出力レベル（ATM_LOG_LEVEL）と、INFOで出力する処理時間の下限（秒）
+LOG_LEVEL = os.environ.get('ATM_LOG_LEVEL', 'INFO').upper()
+SLOW_SPAN_SECONDS = float(os.environ.get('ATM_SLOW_SPAN_SECONDS', '0.5'))
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+logger = logging.getLogger('tracing')
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def process_pool(max_workers=None, initializer=None):
+    """ワーカープロセスのプールを作成
+
+    Streamlitのサーバーなどマルチスレッドのプロセスからforkすると、子プロセスが
+    他のスレッドの持っていたロックを引き継いで止まることがあるため、常にspawnで起動する。
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def configure_logging(level=None):
+    """ログの出力先と書式を設定（プロセスごとに一度だけ）"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        logging.basicConfig(level=level or LOG_LEVEL, format=LOG_FORMAT)
+        _configured = True
+
+
+class SpanRecorder:
+    """1回の再実行（またはバッチ処理1回）で計測した区間の記録"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def table(self):
+        """記録した区間の一覧（開始順）"""
+        with self._lock:
+            return pd.DataFrame(self.spans, columns=['span', 'seconds', 'detail', 'thread'])
+
+    def summary(self):
+        """区間・対象ごとの合計時間と回数（時間の長い順）"""
+        table = self.table()
+        if table.empty:
+            return table
+        return (table.groupby(['span', 'detail'], sort=False)['seconds']
+                .agg(['sum', 'count']).rename(columns={'sum': 'seconds'})
+                .sort_values('seconds', ascending=False).reset_index())
+
+
+# 現在の再実行の記録先（スレッドプールにはcontextvars.copy_context()で引き継ぐ）
+_recorder = contextvars.ContextVar('span_recorder', default=None)
+
+
+def start_recording():
+    """この再実行で計測する区間の記録を開始し、記録先を返す"""
+    recorder = SpanRecorder()
+    _recorder.set(recorder)
+    return recorder
+
+
+def current_recorder():
+    return _recorder.get()
+
+
+def _detail(fields):
+    return ' '.join(f'{key}={value}' for key, value in fields.items())
+
+
+@contextmanager
+def span(name, **fields):
+    """区間の処理時間を計測してログに出力し、記録先があれば追加
+
+    ログは「span=名前 seconds=秒 キー=値 ...」の形式で、SLOW_SPAN_SECONDS
+    以上かかった区間はINFO、それ以外はDEBUGで出力する。
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        detail = _detail(fields)
+        level = logging.INFO if seconds >= SLOW_SPAN_SECONDS else logging.DEBUG
+        logger.log(level, 'span=%s seconds=%.3f %s', name, seconds, detail)
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.add({'span': name, 'seconds': seconds, 'detail': detail,
+                          'thread': threading.current_thread().name})